@@ -1,9 +1,19 @@
 # Contains the methods containing information on each type of chess piece, functionality, and the actual board.
 
+import collections
+import mmap
+import os
+import random
+import struct
+import sys
+
 class ChessPiece:
     """
     A class that holds the color information for each chess piece
     """
+    # pieces only hold their color, so they don't need an instance dictionary
+    __slots__ = ("_color",)
+
     def __init__(self, color):
         self._color = color
 
@@ -17,6 +27,8 @@ class Pawn(ChessPiece):
     """
     Contains the information and valid moves for a pawn
     """
+    __slots__ = ()
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -64,6 +76,8 @@ class Bishop(ChessPiece):
     """
     Contains the information and valid moves for a bishop
     """
+    __slots__ = ()
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -159,6 +173,8 @@ class Rook(ChessPiece):
     """
     Contains the information and valid moves for a rook
     """
+    __slots__ = ()
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -230,6 +246,8 @@ class Queen(ChessPiece):
     """
     Contains the information and valid moves for a queen
     """
+    __slots__ = ()
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -237,22 +255,10 @@ class Queen(ChessPiece):
         """
         Takes in the square that the piece is moving from and returns a list of valid moves
         """
-        possible_moves = []
-
-        # copies over possible moves of a rook
-        rook = Rook("white" if self._color == "white" else "black")
-        rook_style_moves = rook.list_valid_moves(origin, board)
-
-        # copies over possible moves of a bishop
-        bishop = Bishop("white" if self._color == "white" else "black")
-        bishop_style_moves = bishop.list_valid_moves(origin, board)
-
-        # adds them to the list of possible moves for a queen
-        for element in rook_style_moves:
-            possible_moves.append(element)
-
-        for element in bishop_style_moves:
-            possible_moves.append(element)
+        # a queen moves like a rook and a bishop of the same color. The rook and bishop methods only look at
+        # the piece's color, so they run on the queen itself instead of on new Rook and Bishop objects.
+        possible_moves = Rook.list_valid_moves(self, origin, board)
+        possible_moves.extend(Bishop.list_valid_moves(self, origin, board))
 
         return possible_moves
 
@@ -260,6 +266,10 @@ class Knight(ChessPiece):
     """
     Contains the information and valid moves for a knight.
     """
+    __slots__ = ()
+    # All possible "L" shaped moves for a knight
+    STEPS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -269,10 +279,8 @@ class Knight(ChessPiece):
         """
         possible_moves = []
         row_idx, col_idx = origin
-        # All possible "L" shaped moves for a knight
-        move_combinations = [(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)]
 
-        for change in move_combinations:
+        for change in self.STEPS:
             new_row = row_idx + change[0]
             new_col = col_idx + change[1]
             if 0 <= new_row < 8 and 0 <= new_col < 8:
@@ -286,6 +294,10 @@ class King(ChessPiece):
     """
     Contains the information and valid moves for a king.
     """
+    __slots__ = ()
+    # All possible directions for the king (1 square in any direction)
+    STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
     def __init__(self, color):
         super().__init__(color)
 
@@ -295,10 +307,8 @@ class King(ChessPiece):
         """
         possible_moves = []
         row_idx, col_idx = origin
-        # All possible directions for the king (1 square in any direction)
-        move_combinations = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
 
-        for change in move_combinations:
+        for change in self.STEPS:
             new_row = row_idx + change[0]
             new_col = col_idx + change[1]
             if 0 <= new_row < 8 and 0 <= new_col < 8:
@@ -308,6 +318,132 @@ class King(ChessPiece):
 
         return possible_moves
 
+# one shared piece object for each board character. Pieces hold nothing but their color, so the same objects
+# can generate moves for every piece on every board.
+PIECES = {"P": Pawn("white"), "B": Bishop("white"), "R": Rook("white"),
+          "Q": Queen("white"), "N": Knight("white"), "K": King("white"),
+          "p": Pawn("black"), "b": Bishop("black"), "r": Rook("black"),
+          "q": Queen("black"), "n": Knight("black"), "k": King("black")}
+
+# the (row, col) indices of every square in algebraic notation, so moves don't have to be parsed one at a time
+FILES = "abcdefgh"
+FILE_INDICES = {file: col for col, file in enumerate(FILES)}
+SQUARE_INDICES = {file + str(8 - row): (row, col) for file, col in FILE_INDICES.items() for row in range(8)}
+
+
+def square_name(row, col):
+    """
+    Returns the algebraic name of the square at the given indices
+    """
+    return FILES[col] + str(8 - row)
+
+
+# how many of each type of piece each player starts with, by lowercase board character
+START_PIECES = {"p": 8, "n": 2, "b": 2, "r": 2, "q": 1, "k": 1}
+
+# every game state, in the order saved positions, game archives and batches number them
+GAME_STATES = ["UNFINISHED", "WHITE_WON", "BLACK_WON"]
+
+# an immutable copy of the whole game, published by every change to it (see ChessVar.get_snapshot)
+BoardSnapshot = collections.namedtuple("BoardSnapshot", ["version", "board", "turn", "num_turns", "game_state"])
+
+# how many past views of each perspective get_board_changes can compare against
+VIEW_HISTORY_SIZE = 8
+
+# Zobrist keys: one random 64-bit number per piece and square, plus one for black to move. The hash of a
+# position is the XOR of the keys of every piece on its square, so a move only changes a few keys.
+zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {piece: [zobrist_random.getrandbits(64) for square in range(64)] for piece in "PNBRQKpnbrqk"}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+
+# Saved positions (see ChessVar.to_text and ChessVar.to_bytes). The text form is "fow1", the ranks from 8 down to
+# 1 separated by "/" with a digit for each run of empty squares, "w" or "b" for the side to move, the number of
+# turns and the game state. The bytes form is always POSITION.size bytes: b"FOWP", a version byte, one ASCII
+# character per square, the side to move (0 for white, 1 for black), the number of turns and the game state.
+# Either form can hold "*" for the hidden pieces of a view from one player's perspective.
+POSITION_TEXT_PREFIX = "fow1"
+POSITION_MAGIC = b"FOWP"
+POSITION_VERSION = 1
+POSITION = struct.Struct("<4sB64sBIB")
+SQUARE_CHARACTERS = set(" *PNBRQKpnbrqk")
+
+
+def encode_position_text(board, turn, num_turns, game_state):
+    """
+    Returns the text form of the given board, side to move, number of turns and game state
+    """
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == " ":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return " ".join((POSITION_TEXT_PREFIX, "/".join(ranks), turn[0], str(num_turns), game_state))
+
+
+def decode_position_text(text):
+    """
+    Takes in a position in text form and returns a tuple of the board, side to move, number of turns and game
+    state. Raises ValueError if the text isn't a valid position.
+    """
+    fields = text.split()
+    if len(fields) != 5 or fields[0] != POSITION_TEXT_PREFIX:
+        raise ValueError("not a " + POSITION_TEXT_PREFIX + " position: " + repr(text))
+    board = []
+    for rank in fields[1].split("/"):
+        row = []
+        for character in rank:
+            if character in "12345678":
+                row.extend(" " * int(character))
+            elif character in SQUARE_CHARACTERS:
+                row.append(character)
+            else:
+                raise ValueError("unknown piece " + repr(character))
+        if len(row) != 8:
+            raise ValueError("rank " + repr(rank) + " doesn't have 8 squares")
+        board.append(row)
+    if len(board) != 8:
+        raise ValueError("the board doesn't have 8 ranks")
+    turns = {"w": "white", "b": "black"}
+    if fields[2] not in turns or not fields[3].isdigit() or fields[4] not in GAME_STATES:
+        raise ValueError("bad side to move, number of turns or game state in " + repr(text))
+    return board, turns[fields[2]], int(fields[3]), fields[4]
+
+
+def encode_position_bytes(board, turn, num_turns, game_state):
+    """
+    Returns the bytes form of the given board, side to move, number of turns and game state
+    """
+    squares = "".join("".join(row) for row in board).encode("ascii")
+    return POSITION.pack(POSITION_MAGIC, POSITION_VERSION, squares, 0 if turn == "white" else 1, num_turns,
+                         GAME_STATES.index(game_state))
+
+
+def decode_position_bytes(data):
+    """
+    Takes in a position in bytes form and returns a tuple of the board, side to move, number of turns and game
+    state. Raises ValueError if the bytes aren't a valid position.
+    """
+    if len(data) != POSITION.size:
+        raise ValueError("a position is %d bytes, not %d" % (POSITION.size, len(data)))
+    magic, version, squares, turn, num_turns, game_state = POSITION.unpack(data)
+    if magic != POSITION_MAGIC or version != POSITION_VERSION:
+        raise ValueError("not a version %d position" % POSITION_VERSION)
+    squares = squares.decode("ascii", "replace")
+    if not SQUARE_CHARACTERS.issuperset(squares) or turn > 1 or game_state >= len(GAME_STATES):
+        raise ValueError("bad square, side to move or game state in position")
+    board = [list(squares[row * 8:row * 8 + 8]) for row in range(8)]
+    return board, "black" if turn else "white", num_turns, GAME_STATES[game_state]
+
 class ChessVar:
     """ implements an abstract board game based on a chess variant known as Fog of War chess"""
     def __init__(self):
@@ -326,6 +462,19 @@ class ChessVar:
         self._turn = "white"
         # initializes the number of turns to 0
         self._num_turns = 0
+        # the moves made so far, so they can be unmade
+        self._move_stack = []
+        self._hash = self.compute_hash()
+        # goes up every time the position changes, so clients can ask for the changes since a version they hold
+        self._version = 0
+        # recent views handed out for each perspective, by version
+        self._view_history = {"white": {}, "black": {}, "audience": {}}
+        # an optional ViewCache of players' views, shared by position
+        self._view_cache = None
+        # the move mask of each square for the position at _move_masks_version, filled in as they're asked for
+        self._move_masks = [None] * 64
+        self._move_masks_version = 0
+        self.publish_snapshot()
 
     def get_game_state(self):
         """
@@ -333,12 +482,80 @@ class ChessVar:
         """
         return self._game_state
 
+    def load_board(self, board, turn="white", num_turns=0, game_state="UNFINISHED"):
+        """
+        Sets up the game in the given position, taking in the board as 8 rows from rank 8 to rank 1.
+        Any moves made before can no longer be unmade.
+        """
+        self._board = [list(row) for row in board]
+        self._turn = turn
+        self._num_turns = num_turns
+        self._game_state = game_state
+        self._move_stack = []
+        self._hash = self.compute_hash()
+        self._version += 1
+        self.publish_snapshot()
+
+    def compute_hash(self):
+        """
+        Returns the Zobrist hash of the position and side to move, computed from scratch
+        """
+        position_hash = ZOBRIST_BLACK_TO_MOVE if self._turn == "black" else 0
+        for row in range(8):
+            for col in range(8):
+                piece = self._board[row][col]
+                if piece != " ":
+                    position_hash ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        return position_hash
+
+    def get_hash(self):
+        """
+        Returns the 64-bit Zobrist hash of the position and side to move. Equal positions have equal hashes.
+        """
+        return self._hash
+
+    def update_hash(self, origin, destination, piece, captured):
+        """
+        Updates the hash for a move of the piece between the given indices capturing the given piece, or for
+        taking that move back, and for the change of turn
+        """
+        origin_square = origin[0] * 8 + origin[1]
+        destination_square = destination[0] * 8 + destination[1]
+        self._hash ^= ZOBRIST_PIECES[piece][origin_square] ^ ZOBRIST_PIECES[piece][destination_square]
+        if captured != " ":
+            self._hash ^= ZOBRIST_PIECES[captured][destination_square]
+        self._hash ^= ZOBRIST_BLACK_TO_MOVE
+
     def get_board(self, perspective):
         """
         Returns the board based on the given user's perspective
         """
+        if self._view_cache is not None and perspective in ("white", "black"):
+            return self._view_cache.get_view(self, perspective)
+        return self.build_view(perspective)
+
+    def set_view_cache(self, view_cache):
+        """
+        Makes get_board look up players' views in the given ViewCache, which can be shared between games, or
+        stops using one if given None
+        """
+        self._view_cache = view_cache
+
+    def get_position_key(self):
+        """
+        Returns the Zobrist hash of the pieces on the board alone, which decides what each player can see
+        """
+        if self._turn == "black":
+            return self._hash ^ ZOBRIST_BLACK_TO_MOVE
+        return self._hash
+
+    def build_view(self, perspective):
+        """
+        Works out the board from the given user's perspective, without looking in the view cache
+        """
         board_copy = [row[:] for row in self._board]
-        list_of_moves = self.set_visibility(perspective)
+        # a set, since set_visibility lists a square once for every piece that can reach it
+        list_of_moves = set(self.set_visibility(perspective) or ())
 
         if perspective == "white":
             # Return board from white player's perspective
@@ -363,6 +580,136 @@ class ChessVar:
         elif perspective == "audience":
             return self._board
 
+    def get_version(self):
+        """
+        Returns the version of the position, which goes up with every move made or taken back
+        """
+        return self._version
+
+    def get_board_snapshot(self, perspective):
+        """
+        Returns a tuple of the current version and a copy of the board from the given perspective, and remembers
+        the view so later calls to get_board_changes can send only what changed since this version
+        """
+        board = self.get_board(perspective)
+        if perspective == "audience":
+            # get_board hands out the live board for the audience
+            board = [row[:] for row in board]
+        history = self._view_history[perspective]
+        if self._version not in history:
+            history[self._version] = tuple(piece for row in board for piece in row)
+            if len(history) > VIEW_HISTORY_SIZE:
+                # forgets the oldest view
+                del history[next(iter(history))]
+        return self._version, board
+
+    def get_snapshot(self):
+        """
+        Returns the latest BoardSnapshot of the game: its version, the audience's board as a tuple of row tuples,
+        the side to move, the number of turns and the game state. Snapshots never change, so other threads can
+        read them without copying or locking while moves are made.
+        """
+        return self._snapshot
+
+    def publish_snapshot(self, rows=None):
+        """
+        Replaces the latest snapshot with one of the game as it is now. If the indices of the only rows that
+        changed are given, the other rows are shared with the previous snapshot instead of copied.
+        """
+        if rows is None:
+            board = tuple(tuple(row) for row in self._board)
+        else:
+            board = list(self._snapshot.board)
+            for row in rows:
+                board[row] = tuple(self._board[row])
+            board = tuple(board)
+        # a single assignment, so a reader sees either the old snapshot or the new one
+        self._snapshot = BoardSnapshot(self._version, board, self._turn, self._num_turns, self._game_state)
+
+    def get_board_changes(self, perspective, since_version):
+        """
+        Returns a tuple of the current version and a list of (row, col, piece) for every square that looks
+        different from the given perspective than it did at since_version. If that version's view is no longer
+        remembered, the list holds every square, which rebuilds the whole board.
+        """
+        old_view = self._view_history[perspective].get(since_version)
+        version, board = self.get_board_snapshot(perspective)
+        changes = []
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if old_view is None or old_view[row * 8 + col] != piece:
+                    changes.append((row, col, piece))
+        return version, changes
+
+    def clone(self):
+        """
+        Returns an independent copy of the game, including the moves that can be unmade. Much faster than
+        copy.deepcopy, since only the board rows need copying.
+        """
+        game = object.__new__(type(self))
+        game._game_state = self._game_state
+        game._board = [row[:] for row in self._board]
+        game._turn = self._turn
+        game._num_turns = self._num_turns
+        # the stack entries and the remembered views are tuples, so the containers are all that need copying
+        game._move_stack = self._move_stack[:]
+        game._hash = self._hash
+        game._version = self._version
+        game._view_history = {perspective: dict(views) for perspective, views in self._view_history.items()}
+        game._view_cache = self._view_cache
+        game._snapshot = self._snapshot
+        game._move_masks = self._move_masks[:]
+        game._move_masks_version = self._move_masks_version
+        return game
+
+    def to_text(self, perspective="audience"):
+        """
+        Returns the position in text form, like "fow1 rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w 0 UNFINISHED".
+        For "white" or "black", the board is that player's view, with "*" for the pieces they can't see.
+        """
+        return encode_position_text(self.get_view(perspective), self._turn, self._num_turns, self._game_state)
+
+    def to_bytes(self, perspective="audience"):
+        """
+        Returns the position in its fixed-size bytes form, from the given perspective like to_text
+        """
+        return encode_position_bytes(self.get_view(perspective), self._turn, self._num_turns, self._game_state)
+
+    def get_view(self, perspective):
+        """
+        Returns the board from the given perspective for reading only, which is the live board for the audience
+        """
+        # the audience sees the whole board, so there's no need for get_board to work out what's visible
+        if perspective == "audience":
+            return self._board
+        return self.get_board(perspective)
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Returns a new game in the position saved by to_text. Raises ValueError for a view with hidden pieces.
+        """
+        return cls.from_position(*decode_position_text(text))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Returns a new game in the position saved by to_bytes. Raises ValueError for a view with hidden pieces.
+        """
+        return cls.from_position(*decode_position_bytes(data))
+
+    @classmethod
+    def from_position(cls, board, turn, num_turns, game_state):
+        """
+        Returns a new game in the given position, which must not have any hidden pieces
+        """
+        if any("*" in row for row in board):
+            raise ValueError("a view from one player's perspective can't be loaded as a game")
+        game = cls()
+        game.load_board(board, turn, num_turns, game_state)
+        return game
+
     def set_visibility(self, perspective):
 
         list_of_white_moves = []
@@ -370,74 +717,14 @@ class ChessVar:
 
         for row in range(8):
             for col in range(8):
-                piece = self._board[row][col]
-                origin = (row, col)
-
-                if piece.lower() == "p":
-                    pawn = Pawn("white" if piece.isupper() else "black")
-                    if pawn.get_color() == "white":
-                        valid_moves = pawn.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = pawn.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
-
-                if piece.lower() == "b":
-                    bishop = Bishop("white" if piece.isupper() else "black")
-                    if bishop.get_color() == "white":
-                        valid_moves = bishop.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = bishop.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
-
-                if piece.lower() == "r":
-                    rook = Rook("white" if piece.isupper() else "black")
-                    if rook.get_color() == "white":
-                        valid_moves = rook.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = rook.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
-
-                if piece.lower() == "q":
-                    queen = Queen("white" if piece.isupper() else "black")
-                    if queen.get_color() == "white":
-                        valid_moves = queen.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = queen.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
-
-                if piece.lower() == "n":
-                    knight = Knight("white" if piece.isupper() else "black")
-                    if knight.get_color() == "white":
-                        valid_moves = knight.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = knight.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
-
-                if piece.lower() == "k":
-                    king = King("white" if piece.isupper() else "black")
-                    if king.get_color() == "white":
-                        valid_moves = king.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_white_moves.append(move)
-                    else:
-                        valid_moves = king.list_valid_moves(origin, self._board)
-                        for move in valid_moves:
-                            list_of_black_moves.append(move)
+                # looks up the shared piece object for the square, which is None for an empty square
+                mover = PIECES.get(self._board[row][col])
+                if mover is None:
+                    continue
+                if mover._color == "white":
+                    list_of_white_moves.extend(mover.list_valid_moves((row, col), self._board))
+                else:
+                    list_of_black_moves.extend(mover.list_valid_moves((row, col), self._board))
 
         if perspective == "white":
             return list_of_white_moves
@@ -454,21 +741,16 @@ class ChessVar:
         self._game_state = state
 
     def translate_move(self, space_id):
-        dict_to_index = {"a": 0,
-                         "b": 1,
-                         "c": 2,
-                         "d": 3,
-                         "e": 4,
-                         "f": 5,
-                         "g": 6,
-                         "h": 7
-                         }
-
-        column = space_id[0]
-        row = space_id[1]
-
-        column = dict_to_index[column]
-        row = 8 - int(row)
+        """
+        Returns the (row, col) indices on the board of a square in algebraic notation
+        """
+        indices = SQUARE_INDICES.get(space_id)
+        if indices is not None:
+            return indices
+
+        # anything else, such as rank 9, is worked out from the file letter and rank digit
+        column = FILE_INDICES[space_id[0]]
+        row = 8 - int(space_id[1])
 
         return (row,column)
 
@@ -482,7 +764,106 @@ class ChessVar:
         # translates the given spaces to indices on the array
         origin = self.translate_move(square_from)
         destination = self.translate_move(square_to)
+        return self._make_move(origin, destination)
+
+    def make_move_indices(self, origin, destination):
+        """
+        Same as make_move, but takes the squares as (row, col) indices on the board instead of algebraic notation.
+        Returns False for indices that are off the board.
+        """
+        if not (0 <= origin[0] < 8 and 0 <= origin[1] < 8 and 0 <= destination[0] < 8 and 0 <= destination[1] < 8):
+            return False
+        return self._make_move(origin, destination)
+
+    def apply_moves(self, moves):
+        """
+        Makes each (square_from, square_to) move in algebraic notation in order, stopping at the first one that
+        isn't legal. Returns the number of moves made, which is the index of the illegal move if there was one.
+        A square that isn't on the board, such as "z9", makes its move illegal.
+        """
+        made = 0
+        for square_from, square_to in moves:
+            try:
+                origin = self.translate_move(square_from)
+                destination = self.translate_move(square_to)
+            except (KeyError, ValueError, IndexError):
+                break
+            if not self._make_move(origin, destination):
+                break
+            made += 1
+        return made
+
+    def apply_moves_indices(self, moves):
+        """
+        Same as apply_moves, but takes each move as a pair of (row, col) indices like make_move_indices
+        """
+        made = 0
+        for origin, destination in moves:
+            if not self.make_move_indices(origin, destination):
+                break
+            made += 1
+        return made
+
+    def get_move_mask(self, square):
+        """
+        Takes in a square index (row * 8 + col) and returns a 64-bit mask with a bit set for every square index
+        the piece on it can move to, whoever's turn it is. The masks are worked out at most once per position.
+        """
+        if self._move_masks_version != self._version:
+            self._move_masks = [None] * 64
+            self._move_masks_version = self._version
+        mask = self._move_masks[square]
+        if mask is None:
+            mask = 0
+            row, col = divmod(square, 8)
+            piece = self._board[row][col]
+            if piece != " ":
+                for destination_row, destination_col in PIECES[piece].list_valid_moves((row, col), self._board):
+                    target = self._board[destination_row][destination_col]
+                    # a piece can't move onto one of its own color
+                    if target == " " or target.isupper() != piece.isupper():
+                        mask |= SQUARE_MASKS[destination_row * 8 + destination_col]
+            self._move_masks[square] = mask
+        return mask
+
+    def get_piece_squares(self, color):
+        """
+        Returns the list of square indices (row * 8 + col) holding the given color's pieces
+        """
+        if color == "white":
+            return [square for square in range(64) if self._board[square // 8][square % 8].isupper()]
+        return [square for square in range(64) if self._board[square // 8][square % 8].islower()]
+
+    def generate_legal_moves(self):
+        """
+        Yields every (origin, destination) square index pair the side to move can play, working out each
+        piece's moves only when the generator reaches it. Yields nothing once the game is over.
+        """
+        if self._game_state != "UNFINISHED":
+            return
+        for origin in self.get_piece_squares(self._turn):
+            destinations = self.get_move_mask(origin)
+            while destinations:
+                low_bit = destinations & -destinations
+                yield origin, low_bit.bit_length() - 1
+                destinations ^= low_bit
+
+    def is_legal(self, square_from, square_to):
+        """
+        Returns True if make_move would make the move between the given squares in algebraic notation,
+        without making it
+        """
+        origin = self.translate_move(square_from)
+        destination = self.translate_move(square_to)
+        piece = self._board[origin[0]][origin[1]]
+        if piece == " " or piece.isupper() != (self._turn == "white") or self._game_state != "UNFINISHED":
+            return False
+        return self.is_valid_move(origin, destination)
 
+    def _make_move(self, origin, destination):
+        """
+        Makes the move between the given indices if it's legal, and records it so it can be unmade
+        """
         # gets the value of the pieces
         piece = self._board[origin[0]][origin[1]]
         destination_value = self._board[destination[0]][destination[1]]
@@ -499,30 +880,45 @@ class ChessVar:
         if self.get_game_state() != "UNFINISHED":
             return False
 
-        # checks if a pawn move is valid
-        if piece.lower() == "p":
-            pawn = Pawn("white" if piece.isupper() else "black")
-            list_of_valid_moves = pawn.list_valid_moves(origin, self._board)
+        if not self.is_valid_move(origin, destination):
+            return False
+
+        # records what the move changes so unmake_move can put it back
+        self._move_stack.append((origin, destination, destination_value, self._game_state))
+
+        # makes the move and updates the board. if the king is captured, updates the game state
+        self.move_piece(origin, destination)
+        self.update_hash(origin, destination, piece, destination_value)
 
-        if piece.lower() == "b":
-            bishop = Bishop("white" if piece.isupper() else "black")
-            list_of_valid_moves = bishop.list_valid_moves(origin, self._board)
+        if destination_value == "K":
+            self.set_game_state("WHITE_WON")
+        elif destination_value == "k":
+            self.set_game_state("BLACK_WON")
 
-        if piece.lower() == "r":
-            rook = Rook("white" if piece.isupper() else "black")
-            list_of_valid_moves = rook.list_valid_moves(origin, self._board)
+        # updates the turn
+        self.track_turn()
+        self._version += 1
+        self.publish_snapshot((origin[0], destination[0]))
 
-        if piece.lower() == "q":
-            queen = Queen("white" if piece.isupper() else "black")
-            list_of_valid_moves = queen.list_valid_moves(origin, self._board)
+        # returns True
+        return True
 
-        if piece.lower() == "n":
-            knight = Knight("white" if piece.isupper() else "black")
-            list_of_valid_moves = knight.list_valid_moves(origin, self._board)
+    def is_valid_move(self, origin, destination):
+        """
+        Returns True if the piece on the origin indices can legally move to the destination indices
+        """
+        # on the board, the destination only has to be in the origin's move mask
+        if origin[0] >= 0 and destination[0] >= 0:
+            target = SQUARE_MASKS[destination[0] * 8 + destination[1]]
+            return self.get_move_mask(origin[0] * 8 + origin[1]) & target != 0
+
+        # rank 9 translates to row -1, which the list board wraps around to its last row; those moves are
+        # checked against the piece's list of moves
+        piece = self._board[origin[0]][origin[1]]
+        destination_value = self._board[destination[0]][destination[1]]
 
-        if piece.lower() == "k":
-            king = King("white" if piece.isupper() else "black")
-            list_of_valid_moves = king.list_valid_moves(origin, self._board)
+        # looks up the shared piece object for the piece being moved
+        list_of_valid_moves = PIECES[piece].list_valid_moves(origin, self._board)
 
         # if the destination is in the list of valid moves for that piece, returns true
         if destination in list_of_valid_moves:
@@ -536,24 +932,44 @@ class ChessVar:
         if destination_value.islower() and piece.islower():
             move_is_valid = False
 
-        if move_is_valid is True:
-            # makes the move and updates the board. if the king is captured, updates the game state
-            self._board[destination[0]][destination[1]] = self._board[origin[0]][origin[1]]
-            self._board[origin[0]][origin[1]] = " "
+        return move_is_valid
 
-            if destination_value == "K":
-                self.set_game_state("WHITE_WON")
-            elif destination_value == "k":
-                self.set_game_state("BLACK_WON")
+    def move_piece(self, origin, destination):
+        """
+        Moves the piece on the origin indices to the destination indices, replacing whatever was there
+        """
+        self._board[destination[0]][destination[1]] = self._board[origin[0]][origin[1]]
+        self._board[origin[0]][origin[1]] = " "
 
-            # updates the turn
-            self.track_turn()
+    def unmake_move(self):
+        """
+        Takes back the last move made, restoring the board, any captured piece, the turn, the number of turns
+        and the game state. Returns False if there are no moves to take back, otherwise True.
+        """
+        if not self._move_stack:
+            return False
 
-            # returns True
-            return True
+        origin, destination, captured, game_state = self._move_stack.pop()
+        self.update_hash(origin, destination, self._board[destination[0]][destination[1]], captured)
+        self.restore_piece(origin, destination, captured)
+        self._game_state = game_state
 
+        # switches the turn back
+        if self._turn == "white":
+            self._turn = "black"
         else:
-            return False
+            self._turn = "white"
+        self._num_turns -= 1
+        self._version += 1
+        self.publish_snapshot((origin[0], destination[0]))
+        return True
+
+    def restore_piece(self, origin, destination, captured):
+        """
+        Moves the piece on the destination indices back to the origin indices and puts the captured piece back
+        """
+        self._board[origin[0]][origin[1]] = self._board[destination[0]][destination[1]]
+        self._board[destination[0]][destination[1]] = captured
 
     def track_turn(self):
         """
@@ -565,3 +981,761 @@ class ChessVar:
         else:
             self._turn = "white"
         self._num_turns += 1
+
+# Bitboard tables used by BitboardChessVar. Squares are numbered row * 8 + col, so bit 0 is a8
+# and bit 63 is h1, which matches the row/column layout of ChessVar._board.
+
+def build_step_table(steps):
+    """
+    Returns a list of 64 masks holding every square reachable from each square with one of the given (row, col) steps
+    """
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        for row_step, col_step in steps:
+            new_row = row + row_step
+            new_col = col + col_step
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                mask |= 1 << (new_row * 8 + new_col)
+        table.append(mask)
+    return table
+
+
+def build_ray_table(row_step, col_step):
+    """
+    Returns a list of 64 masks holding every square from each square to the edge of the board in one direction
+    """
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        row += row_step
+        col += col_step
+        while 0 <= row < 8 and 0 <= col < 8:
+            mask |= 1 << (row * 8 + col)
+            row += row_step
+            col += col_step
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = build_step_table(Knight.STEPS)
+KING_ATTACKS = build_step_table(King.STEPS)
+PAWN_ATTACKS = {"white": build_step_table([(-1, -1), (-1, 1)]),
+                "black": build_step_table([(1, -1), (1, 1)])}
+
+SQUARE_MASKS = [1 << square for square in range(64)]
+ALL_SQUARES = (1 << 64) - 1
+
+
+def build_move_order(piece):
+    """
+    Returns, for every square index, the (square mask, (row, col)) of every square the given piece could move to
+    from it, in the order its list_valid_moves lists them. Blockers only cut moves off the end of a direction, so
+    any set of the piece's moves keeps this order.
+    """
+    enemy = "p" if piece.isupper() else "P"
+    forward = -1 if piece.isupper() else 1
+    order = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        board = [[" "] * 8 for _ in range(8)]
+        board[row][col] = piece
+        if piece in "Pp" and 0 <= row + forward < 8:
+            # pawns only move diagonally to capture, so they get an enemy piece on both sides to capture
+            for capture_col in (col - 1, col + 1):
+                if 0 <= capture_col < 8:
+                    board[row + forward][capture_col] = enemy
+        order.append([(SQUARE_MASKS[move_row * 8 + move_col], (move_row, move_col))
+                      for move_row, move_col in PIECES[piece].list_valid_moves((row, col), board)])
+    return order
+
+
+# the order ChessVar.set_visibility lists each piece's moves in, by board character and square index
+MOVE_ORDER = {piece: build_move_order(piece) for piece in PIECES}
+
+
+def build_line_table(row_step, col_step):
+    """
+    Returns two lists for the line through each square in the given direction and its opposite: the mask of the
+    squares on it whose contents can stop a sliding piece, which leaves out the squares at the edges of the board,
+    and a dictionary from every set of pieces on those squares to the mask of squares the piece reaches
+    """
+    # each ray holds its ray table and whether the squares along it have increasing indices,
+    # which tells us whether the nearest blocker is the lowest or the highest set bit
+    rays = [(build_ray_table(row_step, col_step), row_step * 8 + col_step > 0),
+            (build_ray_table(-row_step, -col_step), row_step * 8 + col_step < 0)]
+    masks = []
+    tables = []
+    for square in range(64):
+        mask = 0
+        for ray, increasing in rays:
+            reach = ray[square]
+            if reach:
+                # the last square of a ray is reached whether or not there's a piece on it
+                mask |= reach ^ ((1 << (reach.bit_length() - 1)) if increasing else reach & -reach)
+        table = {}
+        blockers = 0
+        while True:
+            attacks = 0
+            for ray, increasing in rays:
+                reach = ray[square]
+                stops = reach & blockers
+                if stops:
+                    if increasing:
+                        stop = (stops & -stops).bit_length() - 1
+                    else:
+                        stop = stops.bit_length() - 1
+                    # cuts the ray off behind the first blocker
+                    reach ^= ray[stop]
+                attacks |= reach
+            table[blockers] = attacks
+            # steps through every subset of the mask
+            blockers = (blockers - mask) & mask
+            if not blockers:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+# for every square and every line through it, the squares that can block a sliding piece and the squares it
+# reaches for each set of blockers, so a slider's moves along a line are a single dictionary lookup
+RANK_BLOCKERS, RANK_ATTACKS = build_line_table(0, 1)
+FILE_BLOCKERS, FILE_ATTACKS = build_line_table(1, 0)
+DIAGONAL_BLOCKERS, DIAGONAL_ATTACKS = build_line_table(1, 1)
+ANTIDIAGONAL_BLOCKERS, ANTIDIAGONAL_ATTACKS = build_line_table(1, -1)
+
+
+def bishop_attacks(square, occupied):
+    """
+    Returns the mask of squares a bishop reaches from the given square, stopping at (and including)
+    the first occupied square in each direction
+    """
+    return (DIAGONAL_ATTACKS[square][occupied & DIAGONAL_BLOCKERS[square]]
+            | ANTIDIAGONAL_ATTACKS[square][occupied & ANTIDIAGONAL_BLOCKERS[square]])
+
+
+def rook_attacks(square, occupied):
+    """
+    Returns the mask of squares a rook reaches from the given square, stopping at (and including)
+    the first occupied square in each direction
+    """
+    return (RANK_ATTACKS[square][occupied & RANK_BLOCKERS[square]]
+            | FILE_ATTACKS[square][occupied & FILE_BLOCKERS[square]])
+
+
+def queen_attacks(square, occupied):
+    """
+    Returns the mask of squares a queen reaches from the given square, stopping at (and including)
+    the first occupied square in each direction
+    """
+    return (RANK_ATTACKS[square][occupied & RANK_BLOCKERS[square]]
+            | FILE_ATTACKS[square][occupied & FILE_BLOCKERS[square]]
+            | DIAGONAL_ATTACKS[square][occupied & DIAGONAL_BLOCKERS[square]]
+            | ANTIDIAGONAL_ATTACKS[square][occupied & ANTIDIAGONAL_BLOCKERS[square]])
+
+
+def mask_to_squares(mask):
+    """
+    Returns the (row, col) indices of every square set in the mask, in board order
+    """
+    squares = []
+    while mask:
+        low_bit = mask & -mask
+        squares.append(divmod(low_bit.bit_length() - 1, 8))
+        mask ^= low_bit
+    return squares
+
+
+# the square in front of each pawn, the square two in front for pawns on their starting row, and every square
+# whose contents decide a pawn's moves
+PAWN_PUSHES = {"white": build_step_table([(-1, 0)]),
+               "black": build_step_table([(1, 0)])}
+PAWN_DOUBLE_PUSHES = {"white": [SQUARE_MASKS[square - 16] if 48 <= square < 56 else 0 for square in range(64)],
+                      "black": [SQUARE_MASKS[square + 16] if 8 <= square < 16 else 0 for square in range(64)]}
+PAWN_INFLUENCE = {color: [PAWN_ATTACKS[color][square] | PAWN_PUSHES[color][square]
+                          | PAWN_DOUBLE_PUSHES[color][square] for square in range(64)]
+                  for color in ("white", "black")}
+
+
+# Each function below takes in a square index and the masks of the squares holding the piece's own color and
+# the enemy's, and returns a tuple of the mask of squares the piece can move to and the mask of squares whose
+# contents decide those moves. The sliders look their lines up directly rather than through bishop_attacks and
+# the like, which saves a call on the hottest path of BitboardChessVar.
+
+def white_pawn_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a white pawn
+    """
+    moves = PAWN_ATTACKS["white"][square] & enemy
+    push = PAWN_PUSHES["white"][square]
+    if push and not push & (own | enemy):
+        moves |= push
+        # two spaces forward from the starting row
+        double_push = PAWN_DOUBLE_PUSHES["white"][square]
+        if double_push and not double_push & (own | enemy):
+            moves |= double_push
+    return moves, PAWN_INFLUENCE["white"][square]
+
+
+def black_pawn_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a black pawn
+    """
+    moves = PAWN_ATTACKS["black"][square] & enemy
+    push = PAWN_PUSHES["black"][square]
+    if push and not push & (own | enemy):
+        moves |= push
+        double_push = PAWN_DOUBLE_PUSHES["black"][square]
+        if double_push and not double_push & (own | enemy):
+            moves |= double_push
+    return moves, PAWN_INFLUENCE["black"][square]
+
+
+def knight_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a knight
+    """
+    influence = KNIGHT_ATTACKS[square]
+    return influence & ~own, influence
+
+
+def king_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a king
+    """
+    influence = KING_ATTACKS[square]
+    return influence & ~own, influence
+
+
+def bishop_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a bishop
+    """
+    occupied = own | enemy
+    influence = (DIAGONAL_ATTACKS[square][occupied & DIAGONAL_BLOCKERS[square]]
+                 | ANTIDIAGONAL_ATTACKS[square][occupied & ANTIDIAGONAL_BLOCKERS[square]])
+    return influence & ~own, influence
+
+
+def rook_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a rook
+    """
+    occupied = own | enemy
+    influence = (RANK_ATTACKS[square][occupied & RANK_BLOCKERS[square]]
+                 | FILE_ATTACKS[square][occupied & FILE_BLOCKERS[square]])
+    return influence & ~own, influence
+
+
+def queen_moves(square, own, enemy):
+    """
+    Returns the moves and influence of a queen
+    """
+    occupied = own | enemy
+    influence = (RANK_ATTACKS[square][occupied & RANK_BLOCKERS[square]]
+                 | FILE_ATTACKS[square][occupied & FILE_BLOCKERS[square]]
+                 | DIAGONAL_ATTACKS[square][occupied & DIAGONAL_BLOCKERS[square]]
+                 | ANTIDIAGONAL_ATTACKS[square][occupied & ANTIDIAGONAL_BLOCKERS[square]])
+    return influence & ~own, influence
+
+
+# the move function for each board character
+PIECE_MOVES = {"P": white_pawn_moves, "p": black_pawn_moves, "N": knight_moves, "n": knight_moves,
+               "B": bishop_moves, "b": bishop_moves, "R": rook_moves, "r": rook_moves,
+               "Q": queen_moves, "q": queen_moves, "K": king_moves, "k": king_moves}
+
+
+def piece_moves(piece, square, own, enemy):
+    """
+    Takes in a board character, a square index and the masks of the squares holding the piece's own color and
+    the enemy's, and returns a tuple of the mask of squares the piece can move to and the mask of squares whose
+    contents decide those moves
+    """
+    return PIECE_MOVES[piece](square, own, enemy)
+
+
+class BitboardChessVar(ChessVar):
+    """
+    A ChessVar that keeps the position as one 64-bit integer per piece type and color and generates moves
+    from precomputed attack tables. Moves, boards and visibility are the same as ChessVar's.
+    """
+    def __init__(self):
+        super().__init__()
+        self.load_bitboards()
+
+    def load_board(self, board, turn="white", num_turns=0, game_state="UNFINISHED"):
+        """
+        Sets up the game in the given position and rebuilds the bitboards for it
+        """
+        super().load_board(board, turn, num_turns, game_state)
+        self.load_bitboards()
+
+    def clone(self):
+        """
+        Returns an independent copy of the game, including its bitboards and cached moves
+        """
+        game = super().clone()
+        game._bitboards = dict(self._bitboards)
+        game._colors = dict(self._colors)
+        game._destinations = self._destinations[:]
+        game._influence = self._influence[:]
+        game._pending = dict(self._pending)
+        game._visible = None if self._visible is None else dict(self._visible)
+        return game
+
+    def load_bitboards(self):
+        """
+        Rebuilds the bitboards, the cached moves of every piece and both players' visibility from self._board
+        """
+        self._bitboards = {piece: 0 for piece in "PNBRQKpnbrqk"}
+        self._colors = {"white": 0, "black": 0}
+        for square in range(64):
+            piece = self._board[square // 8][square % 8]
+            if piece != " ":
+                self._bitboards[piece] |= SQUARE_MASKS[square]
+                self._colors["white" if piece.isupper() else "black"] |= SQUARE_MASKS[square]
+
+        # for every square, the moves of the piece on it and the squares whose contents those moves depend on
+        self._destinations = [0] * 64
+        self._influence = [0] * 64
+        # the squares changed since the cached moves were last brought up to date, with what they held then
+        self._pending = {}
+        for square in range(64):
+            self.refresh_square(square)
+        self.update_visibility()
+
+    def generate_moves(self, square):
+        """
+        Takes in a square index (row * 8 + col) and returns a tuple of the mask of squares the piece on it can
+        move to and the mask of squares whose contents decide those moves
+        """
+        piece = self._board[square // 8][square % 8]
+        if piece == " ":
+            return 0, 0
+
+        if piece.isupper():
+            return PIECE_MOVES[piece](square, self._colors["white"], self._colors["black"])
+        return PIECE_MOVES[piece](square, self._colors["black"], self._colors["white"])
+
+    def refresh_square(self, square):
+        """
+        Regenerates the cached moves of the piece on the given square index
+        """
+        self._destinations[square], self._influence[square] = self.generate_moves(square)
+
+    def get_move_mask(self, square):
+        """
+        Takes in a square index (row * 8 + col) and returns the mask of squares the piece on it can move to,
+        bringing the cached moves up to date first if the board has changed since they were last asked for
+        """
+        if self._pending:
+            self.update_moves()
+        return self._destinations[square]
+
+    def get_piece_squares(self, color):
+        """
+        Returns the list of square indices (row * 8 + col) holding the given color's pieces
+        """
+        squares = []
+        pieces = self._colors[color]
+        while pieces:
+            low_bit = pieces & -pieces
+            squares.append(low_bit.bit_length() - 1)
+            pieces ^= low_bit
+        return squares
+
+    def update_visibility(self):
+        """
+        Rebuilds each player's visibility mask from the cached moves of their pieces
+        """
+        destinations = self._destinations
+        self._visible = {}
+        for color in ("white", "black"):
+            visible = 0
+            pieces = self._colors[color]
+            while pieces:
+                low_bit = pieces & -pieces
+                visible |= destinations[low_bit.bit_length() - 1]
+                pieces ^= low_bit
+            self._visible[color] = visible
+
+    def visibility_mask(self, perspective):
+        """
+        Returns the mask of squares the pieces of the given color can move to
+        """
+        if self._pending:
+            self.update_moves()
+        if self._visible is None:
+            self.update_visibility()
+        return self._visible[perspective]
+
+    def build_view(self, perspective):
+        """
+        Works out the board from the given user's perspective from the visibility masks
+        """
+        if perspective == "audience":
+            return self._board
+
+        if perspective == "white":
+            hidden = self._colors["black"] & ~self.visibility_mask("white")
+        elif perspective == "black":
+            hidden = self._colors["white"] & ~self.visibility_mask("black")
+        else:
+            return
+
+        board_copy = [row[:] for row in self._board]
+        for row, col in mask_to_squares(hidden):
+            board_copy[row][col] = "*"
+        return board_copy
+
+    def set_visibility(self, perspective):
+        """
+        Returns the squares the given player's pieces can move to, in the same order as ChessVar.set_visibility:
+        piece by piece in board order, each listing its moves in the order of its list_valid_moves. A square
+        reachable by several pieces is listed once for each of them.
+        """
+        if perspective not in ("white", "black"):
+            return
+        if self._pending:
+            self.update_moves()
+        moves = []
+        for square in self.get_piece_squares(perspective):
+            destinations = self._destinations[square]
+            if destinations:
+                piece = self._board[square // 8][square % 8]
+                moves.extend(indices for mask, indices in MOVE_ORDER[piece][square] if mask & destinations)
+        return moves
+
+    def move_piece(self, origin, destination):
+        """
+        Moves the piece on the board and the bitboards, removing any captured piece
+        """
+        piece = self._board[origin[0]][origin[1]]
+        captured = self._board[destination[0]][destination[1]]
+        super().move_piece(origin, destination)
+        if origin[0] < 0 or destination[0] < 0:
+            self.load_bitboards()
+            return
+        self.update_squares([(origin[0] * 8 + origin[1], piece, " "),
+                             (destination[0] * 8 + destination[1], captured, piece)])
+
+    def restore_piece(self, origin, destination, captured):
+        """
+        Puts the moved and captured pieces back on the board and the bitboards
+        """
+        piece = self._board[destination[0]][destination[1]]
+        super().restore_piece(origin, destination, captured)
+        if origin[0] < 0 or destination[0] < 0:
+            self.load_bitboards()
+            return
+        self.update_squares([(origin[0] * 8 + origin[1], " ", piece),
+                             (destination[0] * 8 + destination[1], piece, captured)])
+
+    def update_squares(self, changes):
+        """
+        Takes in a list of (square index, old piece, new piece) for the squares that changed on the board and
+        updates the bitboards to match. The cached moves aren't regenerated until they're next asked for, so a
+        search making and unmaking many moves only pays for the positions it looks at.
+        """
+        pending = self._pending
+        for square, old, new in changes:
+            mask = SQUARE_MASKS[square]
+            if old != " ":
+                self._bitboards[old] ^= mask
+                self._colors["white" if old.isupper() else "black"] ^= mask
+            if new != " ":
+                self._bitboards[new] ^= mask
+                self._colors["white" if new.isupper() else "black"] ^= mask
+            # remembers what the square held when the cached moves were last brought up to date
+            if square not in pending:
+                pending[square] = old
+
+    def update_moves(self):
+        """
+        Regenerates the cached moves of the pieces on the squares changed since the cached moves were last brought
+        up to date, and of the pieces whose moves depend on those squares. A square holding the same piece again,
+        as after a move and its unmake, doesn't count as changed.
+        """
+        changed = 0
+        for square, old in self._pending.items():
+            if self._board[square // 8][square % 8] != old:
+                changed |= SQUARE_MASKS[square]
+        self._pending = {}
+        if not changed:
+            return
+
+        # only the pieces on the changed squares and those whose moves depend on them need their moves regenerated
+        influence = self._influence
+        squares = changed
+        while squares:
+            low_bit = squares & -squares
+            self.refresh_square(low_bit.bit_length() - 1)
+            squares ^= low_bit
+        pieces = (self._colors["white"] | self._colors["black"]) & ~changed
+        while pieces:
+            low_bit = pieces & -pieces
+            square = low_bit.bit_length() - 1
+            if influence[square] & changed:
+                self.refresh_square(square)
+            pieces ^= low_bit
+        # the visibility masks are rebuilt the next time they're asked for
+        self._visible = None
+
+
+class TranspositionTable:
+    """
+    A fixed-size table of values keyed by position hash, for search code to remember positions it has already
+    looked at. Each hash maps to one slot. A new entry replaces the one in its slot if it was searched at least
+    as deep, or if the old entry is left over from an earlier search.
+    """
+    def __init__(self, size=1 << 20):
+        self._size = size
+        self._keys = [None] * size
+        self._entries = [None] * size
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    def new_search(self):
+        """
+        Marks every entry stored so far as old, so entries from the next search replace them first
+        """
+        self._generation += 1
+
+    def store(self, key, value, depth=0):
+        """
+        Stores the value for the given position hash, searched to the given depth. Returns True if it was stored.
+        """
+        slot = key % self._size
+        entry = self._entries[slot]
+        if entry is not None and self._keys[slot] != key:
+            stored_depth, generation = entry[:2]
+            if generation == self._generation and stored_depth > depth:
+                return False
+        self._keys[slot] = key
+        self._entries[slot] = (depth, self._generation, value)
+        return True
+
+    def lookup(self, key, depth=0):
+        """
+        Returns the value stored for the given position hash if it was searched at least to the given depth,
+        otherwise None
+        """
+        slot = key % self._size
+        entry = self._entries[slot]
+        if entry is not None and self._keys[slot] == key and entry[0] >= depth:
+            self._hits += 1
+            return entry[2]
+        self._misses += 1
+        return None
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        self._keys = [None] * self._size
+        self._entries = [None] * self._size
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of lookups that found an entry and the number that didn't
+        """
+        return {"hits": self._hits, "misses": self._misses}
+
+    def __len__(self):
+        return self._size - self._entries.count(None)
+
+
+# roughly how much memory one cached view takes: 8 tuples of 8 squares, the tuple holding them, and the key
+VIEW_ENTRY_SIZE = (sys.getsizeof(tuple(range(8))) * 9 + sys.getsizeof(((0, "white"), None))
+                   + sys.getsizeof(1 << 63) + 64)
+
+
+class ViewCache:
+    """
+    A bounded cache of players' views of the board, keyed by the pieces on the board and the perspective, so
+    asking for the same view again costs a lookup instead of working out visibility. Positions are identified
+    by their 64-bit Zobrist hash, and a move changes the hash, so views never go stale. The least recently
+    used views are dropped once the cache holds more than max_bytes.
+    """
+    def __init__(self, max_bytes=16 << 20):
+        self._max_entries = max(1, max_bytes // VIEW_ENTRY_SIZE)
+        self._views = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_view(self, game, perspective):
+        """
+        Returns a new copy of the game's board from the given player's perspective, working it out only if it
+        isn't cached
+        """
+        key = (game.get_position_key(), perspective)
+        view = self._views.get(key)
+        if view is None:
+            self._misses += 1
+            view = tuple(tuple(row) for row in game.build_view(perspective))
+            self._views[key] = view
+            if len(self._views) > self._max_entries:
+                # forgets the least recently used view
+                self._views.popitem(last=False)
+                self._evictions += 1
+        else:
+            self._hits += 1
+            self._views.move_to_end(key)
+        return [list(row) for row in view]
+
+    def clear(self):
+        """
+        Removes every view
+        """
+        self._views.clear()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of hits, misses and evictions, and the number and approximate size
+        in bytes of the views held
+        """
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._views),
+                "bytes": len(self._views) * VIEW_ENTRY_SIZE}
+
+    def __len__(self):
+        return len(self._views)
+
+
+# Endgame tables written by tablebase.py, one file per set of pieces, named by its material signature: the
+# pieces on the board in SIGNATURE_ORDER, such as "KRk". A table file holds TABLE_HEADER (b"FOWT", a version
+# byte and the signature) and then a little-endian int16 for every placement of those pieces and side to move,
+# at index ((square of the first piece * 64 + square of the second piece) * 64 + ...) * 2, plus 1 if black is
+# to move. A value of n > 0 means the side to move can capture the enemy king within n plies, -n means the
+# side to move loses its king within n plies however it plays, and 0 means neither side can force a capture.
+TABLE_MAGIC = b"FOWT"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<4sB8s")
+TABLE_SUFFIX = ".fowtb"
+# the value of placements that can't happen, such as two pieces on one square
+TABLE_INVALID = -32768
+SIGNATURE_ORDER = "KQRBNPkqrbnp"
+
+
+def material_signature(board):
+    """
+    Returns the material signature of the pieces on a board, such as "KRk"
+    """
+    return "".join(sorted((piece for row in board for piece in row if piece != " "), key=SIGNATURE_ORDER.index))
+
+
+def table_index(signature, board, turn):
+    """
+    Returns the index in the given signature's table of the position on the board with the given side to move
+    """
+    squares = {}
+    for square in range(64):
+        piece = board[square // 8][square % 8]
+        if piece != " ":
+            squares.setdefault(piece, []).append(square)
+    index = 0
+    # pieces of the same kind are interchangeable, and the table holds every order of their squares
+    seen = {}
+    for piece in signature:
+        index = index * 64 + squares[piece][seen.get(piece, 0)]
+        seen[piece] = seen.get(piece, 0) + 1
+    return index * 2 + (1 if turn == "black" else 0)
+
+
+class Tablebases:
+    """
+    Looks positions up in the endgame tables in a directory. Each table is memory-mapped the first time it's
+    needed, so only the pages holding the positions looked up are ever read from disk.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._tables = {}
+
+    def get_table(self, signature):
+        """
+        Returns the memory-mapped table for the given material signature, or None if there isn't one
+        """
+        if signature not in self._tables:
+            table = None
+            path = os.path.join(self._directory, signature + TABLE_SUFFIX)
+            if os.path.exists(path):
+                with open(path, "rb") as table_file:
+                    table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, stored_signature = TABLE_HEADER.unpack_from(table, 0)
+                stored_signature = stored_signature.rstrip(b"\0").decode()
+                if magic != TABLE_MAGIC or version != TABLE_VERSION or stored_signature != signature:
+                    table.close()
+                    raise ValueError(path + " is not a version %d table for %s" % (TABLE_VERSION, signature))
+            self._tables[signature] = table
+        return self._tables[signature]
+
+    def probe_board(self, board, turn):
+        """
+        Returns the table value of the position on the board with the given side to move, or None if there's no
+        table for its pieces. Takes in a full board without hidden pieces.
+        """
+        signature = material_signature(board)
+        table = self.get_table(signature)
+        if table is None:
+            return None
+        value = struct.unpack_from("<h", table, TABLE_HEADER.size + table_index(signature, board, turn) * 2)[0]
+        return None if value == TABLE_INVALID else value
+
+    def probe(self, game):
+        """
+        Returns the table value of the game's position for the side to move, or None if the game is over or
+        there's no table for its pieces
+        """
+        if game.get_game_state() != "UNFINISHED":
+            return None
+        return self.probe_board(game._board, game._turn)
+
+    def best_move(self, game):
+        """
+        Returns the (origin, destination) square index pair of the best move in the game's position according to
+        the tables: the fastest king capture when winning, otherwise a draw, otherwise the slowest loss. Returns
+        None if the position isn't in the tables or there are no moves.
+        """
+        if self.probe(game) is None:
+            return None
+        best_move = None
+        best_rank = None
+        for origin, destination in list(game.generate_legal_moves()):
+            game.make_move_indices(divmod(origin, 8), divmod(destination, 8))
+            if game.get_game_state() != "UNFINISHED":
+                value = 1
+            else:
+                # the opponent's value after the move, turned around and one ply further away
+                value = self.probe(game)
+                if value is not None:
+                    value = -value + (1 if value < 0 else -1 if value > 0 else 0)
+            game.unmake_move()
+            if value is None:
+                continue
+            rank = (2, -value) if value > 0 else (1, 0) if value == 0 else (0, -value)
+            if best_rank is None or rank > best_rank:
+                best_move = (origin, destination)
+                best_rank = rank
+        return best_move
+
+    def close(self):
+        """
+        Unmaps every table
+        """
+        for table in self._tables.values():
+            if table is not None:
+                table.close()
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,208 @@
+# Streams game logs through the engine on a pool of processes and reports statistics over all the games: how often
+# each square is visible to each side, how many plies games take to reach the first king capture, how often each
+# type of piece captures each other type, and how often moves are rejected.
+#
+# The log is read a chunk at a time and only a few chunks are in flight at once. Each worker replays its chunk
+# and sums it into a GameStats of fixed-size NumPy arrays. The parent merges those as they come back. Memory use
+# therefore depends on the chunk size and number of processes, not on the size of the log.
+
+import argparse
+import collections
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from archive import ArchiveReader
+from validate import make_tasks, new_game
+
+PIECE_ORDER = "PNBRQKpnbrqk"
+COLORS = ("white", "black")
+# games whose first king capture takes more plies than this are counted in the last bin
+MAX_PLIES = 1000
+
+
+class GameStats:
+    """
+    Running totals over a set of games, which can be merged with the totals of other sets
+    """
+    def __init__(self):
+        self.games = 0
+        self.positions = 0
+        self.accepted = 0
+        self.rejected = 0
+        # how many positions each square was visible in, for each side
+        self.visible = np.zeros((len(COLORS), 64), dtype=np.int64)
+        # how many games had their first king capture after each number of plies
+        self.capture_plies = np.zeros(MAX_PLIES + 1, dtype=np.int64)
+        # how many times each type of piece (row) captured each other type (column), in PIECE_ORDER
+        self.captures = np.zeros((len(PIECE_ORDER), len(PIECE_ORDER)), dtype=np.int64)
+
+    def add_position(self, game):
+        """
+        Counts the squares each side can see in the game's position, which are the squares set_visibility
+        lists for it
+        """
+        self.positions += 1
+        for side, color in enumerate(COLORS):
+            mask = game.visibility_mask(color)
+            self.visible[side] += np.unpackbits(np.frombuffer(mask.to_bytes(8, "little"), dtype=np.uint8),
+                                                bitorder="little")
+
+    def add_game(self, moves, algebraic=True):
+        """
+        Replays one game's moves through make_move, or make_move_indices if algebraic is False, and adds it to
+        the totals. A rejected move leaves the position unchanged and the next move is tried, as in a live game.
+        """
+        game = new_game()
+        self.games += 1
+        self.add_position(game)
+        plies = 0
+        for square_from, square_to in moves:
+            try:
+                if algebraic:
+                    origin = game.translate_move(square_from)
+                    destination = game.translate_move(square_to)
+                    mover = game._board[origin[0]][origin[1]]
+                    captured = game._board[destination[0]][destination[1]]
+                    made = game.make_move(square_from, square_to)
+                else:
+                    mover = game._board[square_from[0]][square_from[1]]
+                    captured = game._board[square_to[0]][square_to[1]]
+                    made = game.make_move_indices(square_from, square_to)
+            except (KeyError, ValueError, IndexError):
+                # a square that isn't on the board
+                made = False
+            if not made:
+                self.rejected += 1
+                continue
+            self.accepted += 1
+            plies += 1
+            if captured != " ":
+                self.captures[PIECE_ORDER.index(mover), PIECE_ORDER.index(captured)] += 1
+            self.add_position(game)
+            if game.get_game_state() != "UNFINISHED":
+                self.capture_plies[min(plies, MAX_PLIES)] += 1
+
+    def merge(self, other):
+        """
+        Adds the totals of another GameStats to these
+        """
+        self.games += other.games
+        self.positions += other.positions
+        self.accepted += other.accepted
+        self.rejected += other.rejected
+        self.visible += other.visible
+        self.capture_plies += other.capture_plies
+        self.captures += other.captures
+
+    def make_report(self):
+        """
+        Returns a dictionary of the statistics, with visibility as the fraction of positions in which each square
+        was visible, as 8 rows from rank 8 to rank 1 for each side
+        """
+        attempted = self.accepted + self.rejected
+        finished = int(self.capture_plies.sum())
+        report = {"games": self.games,
+                  "positions": self.positions,
+                  "moves_accepted": self.accepted,
+                  "moves_rejected": self.rejected,
+                  "rejection_rate": self.rejected / attempted if attempted else 0.0,
+                  "games_with_king_capture": finished}
+        if finished:
+            cumulative = np.cumsum(self.capture_plies)
+            report["plies_to_king_capture"] = {
+                "mean": float(np.dot(np.arange(MAX_PLIES + 1), self.capture_plies) / finished),
+                "p50": int(np.searchsorted(cumulative, finished * 0.5)),
+                "p90": int(np.searchsorted(cumulative, finished * 0.9)),
+                "max": int(np.nonzero(self.capture_plies)[0][-1])}
+        if self.positions:
+            fractions = self.visible / self.positions
+            report["visibility"] = {color: np.round(fractions[side].reshape(8, 8), 4).tolist()
+                                    for side, color in enumerate(COLORS)}
+        captured_totals = self.captures.sum(axis=0)
+        report["captures"] = {
+            "by_captured_piece": {piece: int(captured_totals[index]) for index, piece in enumerate(PIECE_ORDER)},
+            "rate_per_move": {piece: float(captured_totals[index] / self.accepted) if self.accepted else 0.0
+                              for index, piece in enumerate(PIECE_ORDER)},
+            "by_capturing_piece": {mover: {captured: int(self.captures[row, col])
+                                           for col, captured in enumerate(PIECE_ORDER) if self.captures[row, col]}
+                                   for row, mover in enumerate(PIECE_ORDER) if self.captures[row].any()}}
+        return report
+
+
+def analyze_records_chunk(lines):
+    """
+    Returns the GameStats of a chunk of JSON game records (as written by selfplay.py), in a worker process
+    """
+    stats = GameStats()
+    for line in lines:
+        stats.add_game(json.loads(line)["moves"])
+    return stats
+
+
+def analyze_archive_range(task):
+    """
+    Returns the GameStats of the games of an archive from index start up to stop, in a worker process
+    """
+    path, start, stop = task
+    stats = GameStats()
+    with ArchiveReader(path) as reader:
+        for index in range(start, stop):
+            stats.add_game(reader.iter_moves(index), algebraic=False)
+    return stats
+
+
+def run_pipeline(worker, tasks, processes=None, max_pending=None):
+    """
+    Runs the worker on every task on a pool of processes and returns the merged GameStats. Tasks are taken
+    from the iterable only as results come back, with at most max_pending in flight (default: two per process).
+    """
+    total = GameStats()
+    with multiprocessing.Pool(processes) as pool:
+        if max_pending is None:
+            max_pending = 2 * (processes or multiprocessing.cpu_count())
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(worker, (task,)))
+            if len(pending) >= max_pending:
+                total.merge(pending.popleft().get())
+        while pending:
+            total.merge(pending.popleft().get())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports statistics over a log of Fog of War chess games")
+    parser.add_argument("games", help="a game archive, or a file of JSON game records ending in .jsonl")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="games per task sent to a worker")
+    parser.add_argument("--output", help="file to write the report to as JSON (default: standard output)")
+    parser.add_argument("--arrays", help="file to save the raw totals to as a NumPy .npz archive")
+    args = parser.parse_args()
+
+    kind, tasks = make_tasks(args.games, args.chunk_size)
+    worker = analyze_records_chunk if kind == "records" else analyze_archive_range
+
+    start = time.perf_counter()
+    stats = run_pipeline(worker, tasks, args.processes)
+    elapsed = time.perf_counter() - start
+    print("%d games, %d moves in %.1f s, %.0f games/s" % (stats.games, stats.accepted + stats.rejected, elapsed,
+                                                          stats.games / elapsed if elapsed else 0.0),
+          file=sys.stderr)
+
+    report = stats.make_report()
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.arrays:
+        np.savez(args.arrays, visible=stats.visible, capture_plies=stats.capture_plies, captures=stats.captures,
+                 counts=np.array([stats.games, stats.positions, stats.accepted, stats.rejected]))
+
+
+if __name__ == "__main__":
+    main()
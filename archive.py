@@ -0,0 +1,176 @@
+# Stores finished Fog of War chess games in a compact binary archive and reads them back with random access.
+#
+# An archive file starts with a 5-byte header (b"FOWA" and a version byte), followed by one record per game:
+# a 1-byte result (an index into GAME_STATES), a 4-byte move count, and 2 bytes per move holding the from-square
+# and to-square indices (row * 8 + col) in the high and low 6 bits. A sidecar ".idx" file holds the 8-byte
+# offset of every game record, so any game can be found without reading the ones before it.
+
+import argparse
+import json
+import mmap
+import os
+import struct
+
+from ChessVar import ChessVar, GAME_STATES, SQUARE_INDICES, square_name
+
+MAGIC = b"FOWA"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+GAME_HEADER = struct.Struct("<BI")
+OFFSET = struct.Struct("<Q")
+
+
+def encode_move(square_from, square_to):
+    """
+    Takes in a move in algebraic notation and returns it as a 2-byte integer
+    """
+    origin_row, origin_col = SQUARE_INDICES[square_from]
+    destination_row, destination_col = SQUARE_INDICES[square_to]
+    return (origin_row * 8 + origin_col) << 6 | destination_row * 8 + destination_col
+
+
+def decode_move(code):
+    """
+    Takes in a move encoded by encode_move and returns it as a tuple of (row, col) indices for the two squares
+    """
+    return divmod(code >> 6, 8), divmod(code & 63, 8)
+
+
+class ArchiveWriter:
+    """
+    Appends games to an archive file, creating it if it doesn't exist
+    """
+    def __init__(self, path):
+        self._file = open(path, "ab")
+        self._index = open(path + ".idx", "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def append(self, result, moves):
+        """
+        Adds a game with the given result ("UNFINISHED", "WHITE_WON" or "BLACK_WON") and list of
+        (square_from, square_to) moves in algebraic notation
+        """
+        codes = [encode_move(square_from, square_to) for square_from, square_to in moves]
+        self._index.write(OFFSET.pack(self._file.tell()))
+        self._file.write(GAME_HEADER.pack(GAME_STATES.index(result), len(codes)))
+        self._file.write(struct.pack("<%dH" % len(codes), *codes))
+
+    def close(self):
+        """
+        Flushes and closes the archive
+        """
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArchiveReader:
+    """
+    Memory-maps an archive so any game can be read or replayed without loading the rest of the file
+    """
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._index = open(path + ".idx", "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a version %d game archive" % VERSION)
+        if os.fstat(self._index.fileno()).st_size:
+            self._offsets = mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._offsets = b""
+
+    def __len__(self):
+        return len(self._offsets) // OFFSET.size
+
+    def read_header(self, index):
+        """
+        Returns the result and number of moves of the game at the given index, along with where its moves start
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("game index out of range")
+        offset = OFFSET.unpack_from(self._offsets, index * OFFSET.size)[0]
+        result, num_moves = GAME_HEADER.unpack_from(self._data, offset)
+        return GAME_STATES[result], num_moves, offset + GAME_HEADER.size
+
+    def get_result(self, index):
+        """
+        Returns the result of the game at the given index
+        """
+        return self.read_header(index)[0]
+
+    def iter_moves(self, index):
+        """
+        Yields the moves of the game at the given index as pairs of (row, col) indices, reading them straight
+        from the mapped file
+        """
+        result, num_moves, start = self.read_header(index)
+        for (code,) in struct.iter_unpack("<H", self._data[start:start + num_moves * 2]):
+            yield decode_move(code)
+
+    def __getitem__(self, index):
+        """
+        Returns the result of the game at the given index and its moves in algebraic notation
+        """
+        moves = [(square_name(*origin), square_name(*destination)) for origin, destination in self.iter_moves(index)]
+        return self.get_result(index), moves
+
+    def replay(self, index, game=None):
+        """
+        Plays the game at the given index move by move into a new ChessVar, or into the given game, and returns it.
+        Raises ValueError if the archive holds a move the game rejects.
+        """
+        if game is None:
+            game = ChessVar()
+        made = game.apply_moves_indices(self.iter_moves(index))
+        if made != self.read_header(index)[1]:
+            raise ValueError("game %d has an illegal move at index %d" % (index, made))
+        return game
+
+    def close(self):
+        """
+        Unmaps and closes the archive
+        """
+        if isinstance(self._offsets, mmap.mmap):
+            self._offsets.close()
+        self._data.close()
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts and reads Fog of War chess game archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser("import", help="appends JSON game records (as written by selfplay.py)")
+    import_command.add_argument("records", help="file with one JSON game record per line")
+    import_command.add_argument("archive", help="archive file to append to")
+    show_command = commands.add_parser("show", help="prints one game from an archive")
+    show_command.add_argument("archive", help="archive file to read")
+    show_command.add_argument("index", type=int, help="index of the game to print")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        with ArchiveWriter(args.archive) as writer, open(args.records) as records:
+            for line in records:
+                record = json.loads(line)
+                writer.append(record["result"], record["moves"])
+    else:
+        with ArchiveReader(args.archive) as reader:
+            result, moves = reader[args.index]
+            print(json.dumps({"game": args.index, "result": result, "moves": moves}))
+
+
+if __name__ == "__main__":
+    main()
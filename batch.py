@@ -0,0 +1,267 @@
+# Runs many Fog of War chess games side by side on NumPy arrays, for bot training.
+
+import numpy as np
+
+from ChessVar import ChessVar, GAME_STATES
+
+# board cells hold signed piece codes: positive for white (uppercase), negative for black (lowercase)
+PIECE_CODES = {" ": 0,
+               "P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6,
+               "p": -1, "n": -2, "b": -3, "r": -4, "q": -5, "k": -6}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+
+# marks an enemy piece the player can't see in perspective boards, like "*" in ChessVar.get_board
+HIDDEN = 7
+CODE_PIECES[HIDDEN] = "*"
+
+UNFINISHED, WHITE_WON, BLACK_WON = 0, 1, 2
+COLOR_SIGNS = {"white": 1, "black": -1}
+
+
+def build_step_pairs(steps):
+    """
+    Returns the arrays of (from, to) square indices for a piece that moves one step in any of the given directions
+    """
+    sources = []
+    destinations = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        for row_step, col_step in steps:
+            new_row = row + row_step
+            new_col = col + col_step
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                sources.append(square)
+                destinations.append(new_row * 8 + new_col)
+    return np.array(sources), np.array(destinations)
+
+
+def build_ray_steps(row_step, col_step):
+    """
+    Returns a list with one entry per distance along a direction. Each entry holds the (from, to) square indices
+    of every ray that reaches that distance, the positions of those rays in the previous entry, and the square
+    each ray has to pass over to get there.
+    """
+    ray_steps = []
+    rays = [(square, square) for square in range(64)]
+    while True:
+        sources = []
+        destinations = []
+        keep = []
+        passed = []
+        for position, (source, last) in enumerate(rays):
+            row, col = divmod(last, 8)
+            if 0 <= row + row_step < 8 and 0 <= col + col_step < 8:
+                sources.append(source)
+                destinations.append(last + row_step * 8 + col_step)
+                keep.append(position)
+                passed.append(last)
+        if not sources:
+            return ray_steps
+        ray_steps.append((np.array(sources), np.array(destinations), np.array(keep), np.array(passed)))
+        rays = list(zip(sources, destinations))
+
+
+KNIGHT_PAIRS = build_step_pairs([(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)])
+KING_PAIRS = build_step_pairs([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)])
+PAWN_PUSH_PAIRS = {1: build_step_pairs([(-1, 0)]), -1: build_step_pairs([(1, 0)])}
+PAWN_CAPTURE_PAIRS = {1: build_step_pairs([(-1, -1), (-1, 1)]), -1: build_step_pairs([(1, -1), (1, 1)])}
+# two spaces forward from the starting row: (from, over, to)
+PAWN_DOUBLE_PUSHES = {1: (np.arange(48, 56), np.arange(40, 48), np.arange(32, 40)),
+                      -1: (np.arange(8, 16), np.arange(16, 24), np.arange(24, 32))}
+ROOK_RAYS = [build_ray_steps(-1, 0), build_ray_steps(1, 0), build_ray_steps(0, -1), build_ray_steps(0, 1)]
+BISHOP_RAYS = [build_ray_steps(-1, -1), build_ray_steps(-1, 1), build_ray_steps(1, -1), build_ray_steps(1, 1)]
+
+
+def generate_moves(boards, signs):
+    """
+    Takes in an (N, 64) array of boards and an (N,) array of colors (1 for white, -1 for black) and returns an
+    (N, 64, 64) boolean array that is True where the given color's piece on the first square can move to the second
+    """
+    count = len(boards)
+    signed = boards * signs[:, None]
+    own = signed > 0
+    not_own = ~own
+    enemy = signed < 0
+    empty = boards == 0
+    moves = np.zeros((count, 64, 64), dtype=bool)
+
+    for sign in (1, -1):
+        pawns = (signed == PAWN) & (signs == sign)[:, None]
+        sources, destinations = PAWN_PUSH_PAIRS[sign]
+        moves[:, sources, destinations] |= pawns[:, sources] & empty[:, destinations]
+        sources, over, destinations = PAWN_DOUBLE_PUSHES[sign]
+        moves[:, sources, destinations] |= pawns[:, sources] & empty[:, over] & empty[:, destinations]
+        sources, destinations = PAWN_CAPTURE_PAIRS[sign]
+        moves[:, sources, destinations] |= pawns[:, sources] & enemy[:, destinations]
+
+    for piece, (sources, destinations) in ((KNIGHT, KNIGHT_PAIRS), (KING, KING_PAIRS)):
+        pieces = signed == piece
+        moves[:, sources, destinations] |= pieces[:, sources] & not_own[:, destinations]
+
+    queens = signed == QUEEN
+    for sliders, directions in (((signed == ROOK) | queens, ROOK_RAYS), ((signed == BISHOP) | queens, BISHOP_RAYS)):
+        for ray_steps in directions:
+            clear = None
+            for sources, destinations, keep, passed in ray_steps:
+                # a ray keeps going only while the squares it passes over are empty
+                if clear is None:
+                    clear = sliders[:, sources]
+                else:
+                    clear = clear[:, keep] & empty[:, passed]
+                moves[:, sources, destinations] |= clear & not_own[:, destinations]
+
+    return moves
+
+
+class ChessVarBatch:
+    """
+    Holds N Fog of War chess games as an (N, 8, 8) array and generates moves, visibility and game results
+    for all of them at once. Follows the same rules as ChessVar.
+    """
+    def __init__(self, num_games):
+        start = [[PIECE_CODES[piece] for piece in row] for row in ChessVar()._board]
+        self._start = np.array(start, dtype=np.int8)
+        self._boards = np.repeat(self._start[None], num_games, axis=0)
+        # 1 if it's white's turn, -1 if it's black's
+        self._turn = np.ones(num_games, dtype=np.int8)
+        self._num_turns = np.zeros(num_games, dtype=np.int64)
+        self._game_state = np.zeros(num_games, dtype=np.int8)
+
+    @classmethod
+    def from_games(cls, games):
+        """
+        Creates a batch holding copies of the given ChessVar games
+        """
+        batch = cls(len(games))
+        for index, game in enumerate(games):
+            batch._boards[index] = [[PIECE_CODES[piece] for piece in row] for row in game._board]
+            batch._turn[index] = COLOR_SIGNS[game._turn]
+            batch._num_turns[index] = game._num_turns
+            batch._game_state[index] = GAME_STATES.index(game.get_game_state())
+        return batch
+
+    def __len__(self):
+        return len(self._boards)
+
+    def get_boards(self):
+        """
+        Returns the (N, 8, 8) array of piece codes
+        """
+        return self._boards
+
+    def get_turns(self):
+        """
+        Returns the (N,) array of whose turn it is, 1 for white and -1 for black
+        """
+        return self._turn
+
+    def get_game_states(self):
+        """
+        Returns the (N,) array of game states, indexing into GAME_STATES
+        """
+        return self._game_state
+
+    def get_game_state(self, index):
+        """
+        Returns the game state of one game as a string, like ChessVar.get_game_state
+        """
+        return GAME_STATES[self._game_state[index]]
+
+    def unfinished(self):
+        """
+        Returns an (N,) boolean array that is True for the games still in progress
+        """
+        return self._game_state == UNFINISHED
+
+    def legal_move_masks(self):
+        """
+        Returns an (N, 64, 64) boolean array of the (from, to) square indices the side to move can play in each game.
+        Games that have ended have no legal moves.
+        """
+        moves = generate_moves(self._boards.reshape(len(self), 64), self._turn)
+        moves &= self.unfinished()[:, None, None]
+        return moves
+
+    def visibility_masks(self, perspective):
+        """
+        Returns an (N, 64) boolean array of the squares the given player's pieces can move to in each game
+        """
+        signs = np.full(len(self), COLOR_SIGNS[perspective], dtype=np.int8)
+        return generate_moves(self._boards.reshape(len(self), 64), signs).any(axis=1)
+
+    def perspective_boards(self, perspective):
+        """
+        Returns a copy of the (N, 8, 8) boards from the given perspective, with enemy pieces outside the
+        player's view replaced by HIDDEN
+        """
+        boards = self._boards.copy()
+        if perspective == "audience":
+            return boards
+        flat = boards.reshape(len(self), 64)
+        hidden = (flat * COLOR_SIGNS[perspective] < 0) & ~self.visibility_masks(perspective)
+        flat[hidden] = HIDDEN
+        return boards
+
+    def get_board(self, index, perspective):
+        """
+        Returns one game's board from the given perspective as a list of lists, like ChessVar.get_board
+        """
+        board = self.perspective_boards(perspective)[index] if perspective != "audience" else self._boards[index]
+        return [[CODE_PIECES[code] for code in row] for row in board.tolist()]
+
+    def step(self, moves):
+        """
+        Takes in an (N, 2) array of (from, to) square indices (row * 8 + col), one move per game, and makes every
+        legal one. A move of -1 skips that game. Returns an (N,) boolean array of which moves were made.
+        """
+        moves = np.asarray(moves)
+        origins = moves[:, 0]
+        destinations = moves[:, 1]
+        made = np.zeros(len(self), dtype=bool)
+
+        # only games still in progress are looked at
+        active = np.nonzero((origins >= 0) & (destinations >= 0) & self.unfinished())[0]
+        if len(active) == 0:
+            return made
+        origins = origins[active]
+        destinations = destinations[active]
+        boards = self._boards.reshape(len(self), 64)
+        legal = generate_moves(boards[active], self._turn[active])[np.arange(len(active)), origins, destinations]
+        games = active[legal]
+        origins = origins[legal]
+        destinations = destinations[legal]
+
+        # makes the moves, removing any captured piece, and ends games where a king was captured
+        captured = boards[games, destinations]
+        boards[games, destinations] = boards[games, origins]
+        boards[games, origins] = 0
+        # same states as ChessVar.make_move: capturing "K" sets WHITE_WON and capturing "k" sets BLACK_WON
+        self._game_state[games[captured == KING]] = WHITE_WON
+        self._game_state[games[captured == -KING]] = BLACK_WON
+        self._turn[games] *= -1
+        self._num_turns[games] += 1
+        made[games] = True
+        return made
+
+    def random_moves(self, rng):
+        """
+        Returns an (N, 2) array holding a uniformly random legal move for each game, or -1 for games with none
+        """
+        legal = self.legal_move_masks().reshape(len(self), 4096)
+        keys = np.where(legal, rng.random(legal.shape), -1.0)
+        choices = keys.argmax(axis=1)
+        moves = np.stack([choices // 64, choices % 64], axis=1)
+        moves[~legal.any(axis=1)] = -1
+        return moves
+
+    def reset(self, games=None):
+        """
+        Puts the given games (a boolean mask or index array, all games by default) back to the starting position
+        """
+        if games is None:
+            games = slice(None)
+        self._boards[games] = self._start
+        self._turn[games] = 1
+        self._num_turns[games] = 0
+        self._game_state[games] = UNFINISHED
@@ -0,0 +1,266 @@
+# Tracks where each type of hidden enemy piece could be, from one player's views of the board.
+#
+# A player's view (ChessVar.get_board) shows every enemy piece: the ones its pieces can reach by type, the others
+# as "*". So the tracker always knows which squares hold enemy pieces, and only has to work out their types. It
+# keeps one 64-bit mask per piece type of the squares where an enemy piece of that type could be. When an enemy
+# piece moves from one square to another, the new square keeps only the types that could have made that move.
+
+from ChessVar import (ChessVar, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, SQUARE_INDICES, SQUARE_MASKS, START_PIECES,
+                      bishop_attacks, rook_attacks, queen_attacks)
+
+KINDS = "pnbrqk"
+
+
+def square_index(space_id):
+    """
+    Returns the square index (row * 8 + col) of a square in algebraic notation
+    """
+    row, col = SQUARE_INDICES[space_id]
+    return row * 8 + col
+
+
+def bits(mask):
+    """
+    Yields the index of every square set in the mask
+    """
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+class BeliefTracker:
+    """
+    Keeps track of the possible types of the enemy pieces for the player of the given color, starting from the
+    standard starting position
+    """
+    def __init__(self, color):
+        self._color = color
+        self._enemy_color = "black" if color == "white" else "white"
+        self._remaining = dict(START_PIECES)
+        self._candidates = {kind: 0 for kind in KINDS}
+        self._enemy = 0
+        self._own = 0
+        # enemy moves made since the last view (white moves first); more than one means some were missed
+        self._enemy_moves_since_view = 1 if color == "black" else 0
+        for square, piece in enumerate(piece for row in ChessVar()._board for piece in row):
+            if piece == " ":
+                continue
+            if self.is_enemy(piece):
+                self._candidates[piece.lower()] |= SQUARE_MASKS[square]
+                self._enemy |= SQUARE_MASKS[square]
+            else:
+                self._own |= SQUARE_MASKS[square]
+
+    def is_enemy(self, piece):
+        """
+        Returns True if the board character is one of the enemy's pieces (not counting "*")
+        """
+        return piece not in (" ", "*") and piece.isupper() == (self._enemy_color == "white")
+
+    def record_own_move(self, square_from, square_to):
+        """
+        Updates the tracker for a move the player made, removing any enemy piece it captured
+        """
+        origin = square_index(square_from)
+        destination = square_index(square_to)
+        self._own ^= SQUARE_MASKS[origin] | SQUARE_MASKS[destination]
+        if self._enemy & SQUARE_MASKS[destination]:
+            self._enemy ^= SQUARE_MASKS[destination]
+            kinds = self.get_kinds(destination)
+            # the captured piece's type is only counted off when there's no doubt about it, which needs the
+            # tracker to have seen the board since the enemy's last move
+            if len(kinds) == 1 and self._enemy_moves_since_view == 0:
+                self._remaining[kinds[0]] -= 1
+            for kind in KINDS:
+                self._candidates[kind] &= ~SQUARE_MASKS[destination]
+            self.propagate()
+        # the enemy answers every move the player makes
+        self._enemy_moves_since_view += 1
+
+    def observe(self, view):
+        """
+        Updates the tracker from a new view of the board, taken after the enemy has moved
+        """
+        enemy = 0
+        own = 0
+        known = {}
+        for square in range(64):
+            piece = view[square // 8][square % 8]
+            if piece == " ":
+                continue
+            if piece == "*" or self.is_enemy(piece):
+                enemy |= SQUARE_MASKS[square]
+                if piece != "*":
+                    known[square] = piece.lower()
+            else:
+                own |= SQUARE_MASKS[square]
+
+        vacated = self._enemy & ~enemy
+        arrived = enemy & ~self._enemy
+        if self._enemy_moves_since_view > 1:
+            # enemy moves were missed, so pieces may have swapped squares and any piece could be any type it has left
+            for kind in KINDS:
+                self._candidates[kind] = enemy if self._remaining[kind] > 0 else 0
+        elif vacated.bit_count() == 1 and arrived.bit_count() == 1:
+            self.move_enemy(vacated.bit_length() - 1, arrived.bit_length() - 1)
+        self._enemy_moves_since_view = 0
+
+        # any squares still without a possible type could hold any piece the enemy has left
+        unexplained = enemy
+        for kind in KINDS:
+            unexplained &= ~self._candidates[kind]
+        for kind in KINDS:
+            if self._remaining[kind] > 0:
+                self._candidates[kind] |= unexplained
+
+        # pieces the player can see have a known type
+        for square, kind in known.items():
+            for other in KINDS:
+                self._candidates[other] &= ~SQUARE_MASKS[square]
+            self._candidates[kind] |= SQUARE_MASKS[square]
+
+        self._enemy = enemy
+        self._own = own
+        self.propagate()
+
+    def move_enemy(self, origin, destination):
+        """
+        Moves the enemy piece between the given square indices, keeping only the types that could make that move
+        """
+        occupied = self._own | self._enemy
+        captured_own = bool(self._own & SQUARE_MASKS[destination])
+        kinds = [kind for kind in KINDS if self._candidates[kind] & SQUARE_MASKS[origin]]
+        possible = [kind for kind in kinds if self.can_move(kind, origin, destination, occupied, captured_own)]
+        for kind in KINDS:
+            self._candidates[kind] &= ~SQUARE_MASKS[origin]
+        for kind in possible or kinds:
+            self._candidates[kind] |= SQUARE_MASKS[destination]
+        if captured_own:
+            self._own ^= SQUARE_MASKS[destination]
+
+    def can_move(self, kind, origin, destination, occupied, capture):
+        """
+        Returns True if an enemy piece of the given type could move between the given square indices
+        """
+        target = SQUARE_MASKS[destination]
+        if kind == "n":
+            return bool(KNIGHT_ATTACKS[origin] & target)
+        if kind == "k":
+            return bool(KING_ATTACKS[origin] & target)
+        if kind == "b":
+            return bool(bishop_attacks(origin, occupied) & target)
+        if kind == "r":
+            return bool(rook_attacks(origin, occupied) & target)
+        if kind == "q":
+            return bool(queen_attacks(origin, occupied) & target)
+        if capture:
+            return bool(PAWN_ATTACKS[self._enemy_color][origin] & target)
+        step = -8 if self._enemy_color == "white" else 8
+        start_row = 6 if self._enemy_color == "white" else 1
+        if destination == origin + step:
+            return True
+        return origin // 8 == start_row and destination == origin + 2 * step and not occupied & SQUARE_MASKS[origin + step]
+
+    def propagate(self):
+        """
+        Removes a type from every uncertain square once all the enemy's pieces of that type are accounted for
+        """
+        changed = True
+        while changed:
+            changed = False
+            for kind in KINDS:
+                certain = self._candidates[kind]
+                for other in KINDS:
+                    if other != kind:
+                        certain &= ~self._candidates[other]
+                uncertain = self._candidates[kind] & ~certain
+                if uncertain and certain.bit_count() >= self._remaining[kind]:
+                    self._candidates[kind] &= ~uncertain
+                    changed = True
+
+    def get_kinds(self, square):
+        """
+        Returns the list of types the enemy piece on the given square index could be
+        """
+        return [kind for kind in KINDS if self._candidates[kind] & SQUARE_MASKS[square]]
+
+    def get_possible_squares(self, kind):
+        """
+        Returns the mask of squares where an enemy piece of the given type ("p", "n", "b", "r", "q" or "k") could be
+        """
+        return self._candidates[kind]
+
+    def get_type_probabilities(self, square):
+        """
+        Returns a dictionary of the probability of each type for the enemy piece on the given square index, or an
+        empty dictionary if there is no enemy piece there. Each possible type is weighted by how many pieces
+        of that type the enemy has that aren't already accounted for.
+        """
+        kinds = self.get_kinds(square)
+        if len(kinds) <= 1:
+            return {kind: 1.0 for kind in kinds}
+        weights = {}
+        for kind in kinds:
+            certain = self._candidates[kind]
+            for other in KINDS:
+                if other != kind:
+                    certain &= ~self._candidates[other]
+            weights[kind] = max(self._remaining[kind] - certain.bit_count(), 0)
+        total = sum(weights.values())
+        if not total:
+            return {kind: 1 / len(kinds) for kind in kinds}
+        return {kind: weight / total for kind, weight in weights.items()}
+
+    def get_probability(self, kind, square):
+        """
+        Returns the probability that the enemy piece of the given type is on the given square in algebraic
+        notation. For the king, the probabilities over all squares add up to 1.
+        """
+        index = square_index(square)
+        if kind != "k":
+            return self.get_type_probabilities(index).get(kind, 0.0)
+        weights = {candidate: self.get_type_probabilities(candidate).get("k", 0.0)
+                   for candidate in bits(self._candidates["k"])}
+        total = sum(weights.values())
+        return weights.get(index, 0.0) / total if total else 0.0
+
+    def sample_board(self, view, rng):
+        """
+        Returns a full board with a type drawn for every hidden enemy piece in the view, using the tracker's
+        possible types, placing the enemy king on exactly one square and no more pieces of a type than the
+        enemy can have left
+        """
+        board = [row[:] for row in view]
+        enemy_is_upper = self._enemy_color == "white"
+        pawn_back_rank = 7 if enemy_is_upper else 0
+        hidden = [square for square in range(64) if view[square // 8][square % 8] == "*"]
+        rng.shuffle(hidden)
+
+        # how many more of each type can be placed, after the ones the player can see
+        left = dict(self._remaining)
+        for row in view:
+            for piece in row:
+                if self.is_enemy(piece):
+                    left[piece.lower()] = max(left[piece.lower()] - 1, 0)
+
+        king_squares = [square for square in hidden if self._candidates["k"] & SQUARE_MASKS[square]]
+        king_square = None
+        if king_squares and left["k"]:
+            weights = [self.get_type_probabilities(square)["k"] for square in king_squares]
+            king_square = rng.choices(king_squares, weights)[0]
+
+        for square in hidden:
+            if square == king_square:
+                kind = "k"
+            else:
+                kinds = [kind for kind in self.get_kinds(square)
+                         if kind != "k" and left[kind] > 0 and (kind != "p" or square // 8 != pawn_back_rank)]
+                if kinds:
+                    kind = rng.choices(kinds, [left[kind] for kind in kinds])[0]
+                    left[kind] -= 1
+                else:
+                    # nothing left to explain this piece; a pawn is the most common piece
+                    kind = "p" if square // 8 != pawn_back_rank else "n"
+            board[square // 8][square % 8] = kind.upper() if enemy_is_upper else kind
+        return board
@@ -0,0 +1,292 @@
+# Perft node counts and timing benchmarks for the Fog of War chess engines, written out as JSON.
+
+import argparse
+import functools
+import json
+import platform
+import random
+import time
+import timeit
+
+from ChessVar import ChessVar, BitboardChessVar, PIECES, square_name
+from batch import ChessVarBatch
+
+ENGINES = {"list": ChessVar, "bitboard": BitboardChessVar}
+
+# start positions as rows from rank 8 down to rank 1, plus the side to move
+POSITIONS = {
+    "start": ([
+        "rnbqkbnr",
+        "pppppppp",
+        "        ",
+        "        ",
+        "        ",
+        "        ",
+        "PPPPPPPP",
+        "RNBQKBNR",
+    ], "white"),
+    "open": ([
+        "r   k  r",
+        "pp  qppp",
+        "  n  n  ",
+        "  bpp   ",
+        "   PP b ",
+        "  NB N  ",
+        "PP  QPPP",
+        "R   K  R",
+    ], "white"),
+    "sliders": ([
+        "    k   ",
+        "   q    ",
+        "        ",
+        " r    b ",
+        "  B  R  ",
+        "        ",
+        "    Q   ",
+        "    K   ",
+    ], "black"),
+}
+
+# node counts for this variant: no castling, en passant or promotion, and capturing a king ends the game
+PERFT_COUNTS = {
+    "start": [1, 20, 400, 8902, 197742],
+    "open": [1, 38, 1713, 66303],
+    "sliders": [1, 42, 1730, 70488],
+}
+
+
+def load_position(engine, name):
+    """
+    Returns a new game of the given engine class set up in the named position
+    """
+    rows, turn = POSITIONS[name]
+    game = engine()
+    game.load_board(rows, turn)
+    return game
+
+
+def list_moves(game):
+    """
+    Returns every move the side to move can make as a pair of (row, col) indices, generated by the engine's own
+    move generation
+    """
+    return [(divmod(origin, 8), divmod(destination, 8)) for origin, destination in game.generate_legal_moves()]
+
+
+def perft(game, depth):
+    """
+    Returns the number of move sequences of the given length from the game's position. A game that ends
+    on a king capture before the last move has no further moves. Raises RuntimeError if the engine rejects a
+    move it generated, which would otherwise leave the following unmake_move taking back the wrong move.
+    """
+    if depth == 0:
+        return 1
+    nodes = 0
+    for origin, destination in list_moves(game):
+        if not game.make_move_indices(origin, destination):
+            raise RuntimeError("%s rejected its own move from %s to %s" % (type(game).__name__, origin, destination))
+        nodes += perft(game, depth - 1)
+        game.unmake_move()
+    return nodes
+
+
+def play_random_game(engine, rng, max_moves=300):
+    """
+    Plays a game with random moves until a king is captured or max_moves is reached, viewing both perspectives
+    after every move. Returns the number of moves made.
+    """
+    game = engine()
+    moves_made = 0
+    while game.get_game_state() == "UNFINISHED" and moves_made < max_moves:
+        moves = list_moves(game)
+        if not moves:
+            break
+        game.make_move_indices(*rng.choice(moves))
+        game.get_board("white")
+        game.get_board("black")
+        moves_made += 1
+    return moves_made
+
+
+def compare_games(games, batch):
+    """
+    Raises RuntimeError if the given games (one of each engine) and the one-game batch disagree on the game
+    state, on get_board from any perspective or on set_visibility, or if a game's incremental hash differs
+    from one computed from scratch
+    """
+    reference = games[0]
+    for perspective in ("white", "black", "audience"):
+        expected = reference.get_board(perspective)
+        for game in games[1:]:
+            if game.get_board(perspective) != expected:
+                raise RuntimeError("%s and %s disagree on get_board(%r)"
+                                   % (type(reference).__name__, type(game).__name__, perspective))
+        if batch.get_board(0, perspective) != expected:
+            raise RuntimeError("ChessVarBatch and %s disagree on get_board(%r)"
+                               % (type(reference).__name__, perspective))
+    for perspective in ("white", "black"):
+        expected = reference.set_visibility(perspective)
+        for game in games[1:]:
+            if game.set_visibility(perspective) != expected:
+                raise RuntimeError("%s and %s disagree on set_visibility(%r)"
+                                   % (type(reference).__name__, type(game).__name__, perspective))
+    for game in games:
+        if game.get_game_state() != batch.get_game_state(0):
+            raise RuntimeError("ChessVarBatch and %s disagree on the game state" % type(game).__name__)
+        if game.get_hash() != game.compute_hash():
+            raise RuntimeError("%s's incremental hash doesn't match compute_hash()" % type(game).__name__)
+
+
+def check_engines(games, seed, max_moves=300):
+    """
+    Plays random games with every engine and a one-game ChessVarBatch side by side, taking moves back at random
+    and sometimes trying a random move that may be illegal, and compares them after every step (see
+    compare_games). The batch has no unmake_move, so it's copied from the list engine's game after each one.
+    Raises RuntimeError on the first difference, and otherwise returns the numbers of moves made and unmade.
+    """
+    rng = random.Random(seed)
+    made = unmade = 0
+    for _ in range(games):
+        engines = [engine() for engine in ENGINES.values()]
+        batch = ChessVarBatch(1)
+        for _ in range(max_moves):
+            if engines[0]._move_stack and rng.random() < 0.25:
+                results = [game.unmake_move() for game in engines]
+                batch = ChessVarBatch.from_games(engines[:1])
+                unmade += 1
+            else:
+                moves = list_moves(engines[0])
+                if moves and rng.random() < 0.9:
+                    origin, destination = rng.choice(moves)
+                else:
+                    origin, destination = divmod(rng.randrange(64), 8), divmod(rng.randrange(64), 8)
+                results = [game.make_move(square_name(*origin), square_name(*destination)) for game in engines]
+                results.append(bool(batch.step([[origin[0] * 8 + origin[1], destination[0] * 8 + destination[1]]])[0]))
+                made += results[0]
+            if len(set(results)) != 1:
+                raise RuntimeError("the engines disagree on whether a move can be made or unmade: %s" % results)
+            compare_games(engines, batch)
+    return made, unmade
+
+
+def time_call(function, repeat, number):
+    """
+    Returns the best time per call, in microseconds, of the given function over several runs
+    """
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number * 1e6
+
+
+def run_perft(engine_name, depth):
+    """
+    Returns the perft results for every start position, checking them against the known counts
+    """
+    results = []
+    for name in POSITIONS:
+        for current_depth in range(1, depth + 1):
+            game = load_position(ENGINES[engine_name], name)
+            start = time.perf_counter()
+            nodes = perft(game, current_depth)
+            elapsed = time.perf_counter() - start
+            known = PERFT_COUNTS[name]
+            expected = known[current_depth] if current_depth < len(known) else None
+            results.append({"position": name,
+                            "depth": current_depth,
+                            "nodes": nodes,
+                            "expected": expected,
+                            "correct": expected is None or nodes == expected,
+                            "seconds": elapsed,
+                            "nodes_per_second": nodes / elapsed if elapsed else None})
+    return results
+
+
+def run_micro(engine_name, repeat, number):
+    """
+    Returns the time per call of each piece type's move generation and of get_board from each perspective:
+    list_valid_moves for the list engine, and generate_moves for the bitboard engine
+    """
+    results = {}
+    game = load_position(ENGINES[engine_name], "open")
+
+    for square in range(64):
+        piece = game._board[square // 8][square % 8]
+        if piece == " ":
+            continue
+        mover = PIECES[piece]
+        if isinstance(game, BitboardChessVar):
+            key = "generate_moves." + type(mover).__name__
+            call = functools.partial(game.generate_moves, square)
+        else:
+            key = "list_valid_moves." + type(mover).__name__
+            call = functools.partial(mover.list_valid_moves, divmod(square, 8), game._board)
+        if key not in results:
+            results[key] = time_call(call, repeat, number)
+
+    for perspective in ("white", "black", "audience"):
+        results["get_board." + perspective] = time_call(lambda: game.get_board(perspective), repeat, number)
+    return results
+
+
+def run_playouts(engine_name, games, seed):
+    """
+    Returns the throughput of full random games with both perspective views after every move
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    total_moves = 0
+    for _ in range(games):
+        total_moves += play_random_game(ENGINES[engine_name], rng)
+    elapsed = time.perf_counter() - start
+    return {"games": games,
+            "moves": total_moves,
+            "seconds": elapsed,
+            "games_per_second": games / elapsed,
+            "moves_per_second": total_moves / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Fog of War chess engines")
+    parser.add_argument("--engine", choices=sorted(ENGINES), action="append",
+                        help="engine to benchmark (default: all)")
+    parser.add_argument("--depth", type=int, default=3, help="deepest perft depth to run")
+    parser.add_argument("--games", type=int, default=20, help="number of random playouts")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per micro-benchmark")
+    parser.add_argument("--number", type=int, default=1000, help="calls per timing run")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random playouts")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--check", action="store_true",
+                        help="instead of benchmarking, check that the engines agree over --games random games")
+    args = parser.parse_args()
+
+    if args.check:
+        try:
+            made, unmade = check_engines(args.games, args.seed)
+        except RuntimeError as error:
+            raise SystemExit(str(error))
+        print("the engines agree over %d games, %d moves made and %d unmade" % (args.games, made, unmade))
+        return
+
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "engines": {}}
+    failed = False
+    for engine_name in args.engine or sorted(ENGINES):
+        perft_results = run_perft(engine_name, args.depth)
+        failed = failed or not all(result["correct"] for result in perft_results)
+        report["engines"][engine_name] = {"perft": perft_results,
+                                          "micro_us": run_micro(engine_name, args.repeat, args.number),
+                                          "playouts": run_playouts(engine_name, args.games, args.seed)}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if failed:
+        raise SystemExit("perft node counts do not match the known counts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# A Fog of War chess bot using information-set Monte Carlo tree search over the player's own view of the board.
+#
+# The bot only sees get_board(color): its own pieces, the enemy pieces its pieces can reach, and "*" for every
+# other enemy piece. Each search iteration guesses the type of every "*" piece from the enemy pieces that could
+# still be on the board, then walks and grows one shared tree using only the moves legal in that guess
+# (single-observer ISMCTS). Searches run in parallel worker processes (root parallelization) for a fixed
+# wall-clock budget and their root statistics are merged.
+
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from ChessVar import BitboardChessVar, SQUARE_MASKS, START_PIECES, square_name
+
+PIECE_VALUES = {"p": 1, "n": 3, "b": 3, "r": 5, "q": 9, "k": 0}
+EXPLORATION = 0.7
+ROLLOUT_DEPTH = 30
+# time kept back from each worker's budget for sending its results to the parent, and from the parent's
+# budget for merging them and picking the move
+WORKER_MARGIN = 0.02
+MERGE_MARGIN = 0.005
+
+
+def free_cores():
+    """
+    Returns the number of cores this process may run on, less the one it runs on itself
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = multiprocessing.cpu_count()
+    return max(0, cores - 1)
+
+
+def legal_moves(game):
+    """
+    Returns the list of every (origin, destination) square index pair the side to move can play
+    """
+    return list(game.generate_legal_moves())
+
+
+def sample_determinization(view, color, rng):
+    """
+    Takes in a board from the given player's perspective and returns a full board with a piece type guessed for
+    every hidden enemy piece, drawn from the enemy pieces not already visible
+    """
+    board = [row[:] for row in view]
+    enemy_is_upper = color == "black"
+    hidden = []
+    remaining = dict(START_PIECES)
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece == "*":
+                hidden.append((row, col))
+            elif piece != " " and piece.isupper() == enemy_is_upper:
+                remaining[piece.lower()] = max(0, remaining[piece.lower()] - 1)
+
+    rng.shuffle(hidden)
+    others = []
+    for kind in "qrbnp":
+        others.extend(kind * remaining[kind])
+    rng.shuffle(others)
+    # the enemy king has to be somewhere, so it goes on a hidden square first
+    pool = (["k"] if remaining["k"] else []) + others
+
+    # pawns can't stand on their own back rank, so they go to the first hidden square that allows them
+    pawn_back_rank = 7 if enemy_is_upper else 0
+    for row, col in hidden:
+        kind = None
+        for index, candidate in enumerate(pool):
+            if candidate != "p" or row != pawn_back_rank:
+                kind = pool.pop(index)
+                break
+        if kind is None:
+            # more hidden pieces than the enemy can have left; a pawn is the most likely piece
+            kind = "p" if row != pawn_back_rank else "n"
+        board[row][col] = kind.upper() if enemy_is_upper else kind
+    return board
+
+
+class Node:
+    """
+    One move in the search tree, with its statistics from the point of view of the player who made it
+    """
+    __slots__ = ("children", "visits", "reward", "availability")
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.reward = 0.0
+        # how many times this move was legal when its parent was visited
+        self.availability = 1
+
+
+def evaluate(game, color):
+    """
+    Returns a reward between 0 and 1 for the given player from the material left on the board
+    """
+    balance = 0
+    for row in game._board:
+        for piece in row:
+            if piece != " ":
+                value = PIECE_VALUES[piece.lower()]
+                balance += value if piece.isupper() == (color == "white") else -value
+    return 1 / (1 + math.exp(-balance / 4))
+
+
+def rollout(game, color, rng, depth, deadline):
+    """
+    Plays random moves from the game's position, capturing a king whenever possible, and returns the reward for
+    the given player. Stops early at the deadline (a time.perf_counter value) and scores the position reached.
+    """
+    made = 0
+    while made < depth and time.perf_counter() < deadline:
+        moves = legal_moves(game)
+        if not moves:
+            break
+        enemy_king = game._bitboards["k" if game._turn == "white" else "K"]
+        move = None
+        for origin, destination in moves:
+            if SQUARE_MASKS[destination] & enemy_king:
+                move = (origin, destination)
+                break
+        mover = game._turn
+        if move is None:
+            move = rng.choice(moves)
+        game.make_move_indices(divmod(move[0], 8), divmod(move[1], 8))
+        made += 1
+        if game.get_game_state() != "UNFINISHED":
+            return 1.0 if mover == color else 0.0
+    return evaluate(game, color)
+
+
+def search(view, color, budget, rng, root=None, belief=None):
+    """
+    Runs ISMCTS from the given view for budget seconds and returns the root node. If a belief.BeliefTracker for
+    the player is given, hidden pieces are guessed from it instead of from the enemy's starting pieces.
+    """
+    deadline = time.perf_counter() + budget
+    root = root or Node()
+    game = BitboardChessVar()
+    iterations = 0
+    while iterations == 0 or time.perf_counter() < deadline:
+        iterations += 1
+        if belief is None:
+            game.load_board(sample_determinization(view, color, rng), color)
+        else:
+            game.load_board(belief.sample_board(view, rng), color)
+        node = root
+        path = []
+        winner = None
+
+        # selection and expansion, using only the moves legal in this determinization
+        while True:
+            moves = legal_moves(game)
+            if not moves:
+                break
+            untried = []
+            for move in moves:
+                child = node.children.get(move)
+                if child is None:
+                    untried.append(move)
+                else:
+                    child.availability += 1
+            mover = game._turn
+            if untried:
+                move = rng.choice(untried)
+                child = node.children[move] = Node()
+            else:
+                move = max(moves, key=lambda legal: node.children[legal].reward / node.children[legal].visits
+                           + EXPLORATION * math.sqrt(math.log(node.children[legal].availability)
+                                                     / node.children[legal].visits))
+                child = node.children[move]
+            game.make_move_indices(divmod(move[0], 8), divmod(move[1], 8))
+            path.append((child, mover))
+            node = child
+            if game.get_game_state() != "UNFINISHED":
+                winner = mover
+                break
+            if untried:
+                break
+
+        if winner is not None:
+            reward = 1.0 if winner == color else 0.0
+        else:
+            reward = rollout(game, color, rng, ROLLOUT_DEPTH, deadline)
+
+        for child, mover in path:
+            child.visits += 1
+            child.reward += reward if mover == color else 1.0 - reward
+    return root
+
+
+def search_worker(task):
+    """
+    Runs one search in a worker process and returns the visits and reward of each root move
+    """
+    view, color, budget, seed, belief = task
+    root = search(view, color, budget, random.Random(seed), belief=belief)
+    return {move: (child.visits, child.reward) for move, child in root.children.items()}
+
+
+class MCTSBot:
+    """
+    Picks moves for one player from that player's view of the board, answering within budget seconds per move.
+    Searches run on the given number of worker processes, at most one per free core (default: every free core);
+    with none, the search runs in the calling process.
+    """
+    def __init__(self, budget=0.1, processes=None, seed=0):
+        self._budget = budget
+        self._rng = random.Random(seed)
+        # workers sharing cores with each other or with this process would all overrun the budget
+        self._processes = free_cores() if processes is None else min(processes, free_cores())
+        # the workers are started once, since starting processes takes longer than a move's budget
+        self._pool = multiprocessing.Pool(self._processes) if self._processes else None
+
+    def choose_move(self, view, color, belief=None):
+        """
+        Returns the (square_from, square_to) move to play in algebraic notation, or None if there is none.
+        Takes an optional belief.BeliefTracker kept up to date for the player.
+        """
+        # one deadline covers the search, merging the results and picking the move
+        deadline = time.perf_counter() + self._budget
+
+        # a random legal move, worked out before searching so it's ready if no search answers in time. The
+        # player's own moves are the same whatever the hidden pieces are guessed to be.
+        game = BitboardChessVar()
+        game.load_board(sample_determinization(view, color, self._rng), color)
+        moves = legal_moves(game)
+        if not moves:
+            return None
+        fallback = self._rng.choice(moves)
+
+        if self._pool is None:
+            root = search(view, color, max(0.0, deadline - MERGE_MARGIN - time.perf_counter()), self._rng,
+                          belief=belief)
+            stats = {move: (child.visits, child.reward) for move, child in root.children.items()}
+        else:
+            budget = max(0.0, deadline - WORKER_MARGIN - time.perf_counter())
+            tasks = [(view, color, budget, self._rng.getrandbits(64), belief) for _ in range(self._processes)]
+            pending = [self._pool.apply_async(search_worker, (task,)) for task in tasks]
+            stats = {}
+            # merges the root statistics of every worker that answers in time
+            for result in pending:
+                remaining = deadline - MERGE_MARGIN - time.perf_counter()
+                try:
+                    worker_stats = result.get(timeout=max(0.0, remaining))
+                except multiprocessing.TimeoutError:
+                    continue
+                for move, (visits, reward) in worker_stats.items():
+                    total_visits, total_reward = stats.get(move, (0, 0.0))
+                    stats[move] = (total_visits + visits, total_reward + reward)
+
+        if not stats:
+            return square_name(*divmod(fallback[0], 8)), square_name(*divmod(fallback[1], 8))
+        origin, destination = max(stats, key=lambda move: stats[move][0])
+        return square_name(*divmod(origin, 8)), square_name(*divmod(destination, 8))
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def mcts_policy(view, color, rng):
+    """
+    A policy for selfplay.py that searches in the calling process, for 50 ms per move
+    """
+    root = search(view, color, 0.05, rng)
+    if not root.children:
+        return None
+    move = max(root.children, key=lambda legal: root.children[legal].visits)
+    return square_name(*divmod(move[0], 8)), square_name(*divmod(move[1], 8))
@@ -0,0 +1,148 @@
+# Opt-in counters and timers for the hot paths of the Fog of War chess engines.
+#
+# While a Profiler is running, the methods it watches on ChessVar, BitboardChessVar and the piece classes are
+# replaced with wrappers that count and time every call. Stopping it puts the originals back, so the engines run exactly as before when no profiler is
+# running. Times include everything a method calls, but a method calling itself (for example a queen using the
+# rook's moves) is only counted once.
+
+import functools
+import time
+
+from ChessVar import ChessVar, BitboardChessVar, PIECES, Pawn, Bishop, Rook, Queen, Knight, King
+
+GAME_CLASSES = (ChessVar, BitboardChessVar)
+GAME_METHODS = ("make_move", "make_move_indices", "set_visibility", "get_board", "translate_move",
+                "generate_moves", "refresh_square", "update_squares", "update_moves")
+PIECE_CLASSES = (Pawn, Bishop, Rook, Queen, Knight, King)
+# methods that return True or False for an accepted or rejected move
+MOVE_METHODS = ("make_move", "make_move_indices")
+# methods that return a list of moves
+LIST_METHODS = ("set_visibility", "list_valid_moves")
+# methods that return a mask of moves first
+MASK_METHODS = ("generate_moves",)
+
+
+class Profiler:
+    """
+    Counts and times calls to the engines' hot paths while it's running. Use it as a context manager, or call
+    start() and stop(). Only one profiler can run at a time.
+    """
+    _running = None
+
+    def __init__(self):
+        self._stats = {}
+        self._active = set()
+        self._originals = []
+
+    def start(self):
+        """
+        Starts counting, replacing the watched methods with counting wrappers
+        """
+        if Profiler._running is not None:
+            raise RuntimeError("a profiler is already running")
+        Profiler._running = self
+        for game_class in GAME_CLASSES:
+            for name in GAME_METHODS:
+                # only the classes that define a method get a wrapper, so an inherited method isn't wrapped twice
+                if name in vars(game_class):
+                    self.wrap(game_class, name)
+        for piece_class in PIECE_CLASSES:
+            self.wrap(piece_class, "list_valid_moves")
+
+    def stop(self):
+        """
+        Stops counting and puts the original methods back. The counts are kept.
+        """
+        for owner, name, original in self._originals:
+            setattr(owner, name, original)
+        self._originals = []
+        if Profiler._running is self:
+            Profiler._running = None
+
+    def wrap(self, owner, name):
+        """
+        Replaces the method with the given name on the given class with one that records every call to it
+        """
+        original = vars(owner)[name]
+        self._originals.append((owner, name, original))
+
+        @functools.wraps(original)
+        def counted(*args, **kwargs):
+            key = self.get_key(name, args, kwargs)
+            if key in self._active:
+                return original(*args, **kwargs)
+            self._active.add(key)
+            start = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._active.discard(key)
+            self.record(key, name, elapsed, result)
+            return result
+
+        setattr(owner, name, counted)
+
+    def get_key(self, name, args, kwargs):
+        """
+        Returns the name a call is counted under: get_board by perspective, and list_valid_moves and
+        generate_moves by piece type. The first argument is the instance.
+        """
+        if name == "get_board":
+            return "get_board." + str(args[1] if len(args) > 1 else kwargs.get("perspective"))
+        if name == "list_valid_moves":
+            return type(args[0]).__name__ + ".list_valid_moves"
+        if name == "generate_moves":
+            # generate_moves takes a square index, which may be empty
+            square = args[1] if len(args) > 1 else kwargs["square"]
+            mover = PIECES.get(args[0]._board[square // 8][square % 8])
+            return (type(mover).__name__ if mover else "empty") + ".generate_moves"
+        return name
+
+    def record(self, key, name, elapsed, result):
+        """
+        Adds one call and what it returned to the counts under the given key
+        """
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {"calls": 0, "seconds": 0.0}
+            if name in MOVE_METHODS:
+                stats["accepted"] = 0
+                stats["rejected"] = 0
+            elif name in LIST_METHODS or name in MASK_METHODS:
+                stats["moves"] = 0
+        stats["calls"] += 1
+        stats["seconds"] += elapsed
+        if name in MOVE_METHODS:
+            stats["accepted" if result else "rejected"] += 1
+        elif name in LIST_METHODS:
+            stats["moves"] += len(result or ())
+        elif name in MASK_METHODS:
+            stats["moves"] += result[0].bit_count()
+
+    def snapshot(self):
+        """
+        Returns a dictionary of the counts so far, keyed by method, with the average time of each call and, for
+        methods that list moves, the average number of moves per call
+        """
+        snapshot = {}
+        for key, stats in self._stats.items():
+            entry = dict(stats)
+            entry["microseconds_per_call"] = stats["seconds"] / stats["calls"] * 1e6
+            if "moves" in stats:
+                entry["moves_per_call"] = stats["moves"] / stats["calls"]
+            snapshot[key] = entry
+        return snapshot
+
+    def reset(self):
+        """
+        Clears the counts
+        """
+        self._stats = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
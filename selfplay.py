@@ -0,0 +1,168 @@
+# Plays Fog of War chess games between move-selection policies on a pool of processes, for bot training.
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from ChessVar import BitboardChessVar, PIECES, SQUARE_INDICES, square_name
+
+
+def list_view_moves(view, color):
+    """
+    Takes in a board from a player's perspective and returns every (square_from, square_to) move that player
+    can make. Hidden enemy pieces ("*") can never be captured, so moves found on the view are the same as on
+    the real board.
+    """
+    moves = []
+    for row in range(8):
+        for col in range(8):
+            piece = view[row][col]
+            if piece in (" ", "*") or piece.isupper() != (color == "white"):
+                continue
+            for destination in PIECES[piece].list_valid_moves((row, col), view):
+                moves.append((square_name(row, col), square_name(*destination)))
+    return moves
+
+
+def random_policy(view, color, rng):
+    """
+    Picks a random move, or returns None if there are none
+    """
+    moves = list_view_moves(view, color)
+    if not moves:
+        return None
+    return rng.choice(moves)
+
+
+def capture_policy(view, color, rng):
+    """
+    Captures the enemy king if it can, otherwise captures a random visible piece, otherwise moves at random
+    """
+    moves = list_view_moves(view, color)
+    if not moves:
+        return None
+    captures = []
+    for square_from, square_to in moves:
+        row, col = SQUARE_INDICES[square_to]
+        target = view[row][col]
+        if target in ("K", "k"):
+            return square_from, square_to
+        if target != " ":
+            captures.append((square_from, square_to))
+    return rng.choice(captures or moves)
+
+
+POLICIES = {"random": random_policy, "capture": capture_policy}
+
+
+def load_policy(name):
+    """
+    Returns the policy with the given name, either one of POLICIES or "module:function" for a policy defined
+    elsewhere. A policy takes in (view, color, rng) and returns a (square_from, square_to) move or None.
+    """
+    if name in POLICIES:
+        return POLICIES[name]
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise ValueError("unknown policy " + repr(name))
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def play_game(white_policy, black_policy, rng, max_moves=500, latencies=None):
+    """
+    Plays one game, showing each policy only its own perspective of the board, until the game is over, the
+    player to move has no moves, or max_moves have been made. Returns the result and the list of moves.
+    If given a dictionary of a list for each color, appends how many seconds each policy took to pick each move.
+    """
+    game = BitboardChessVar()
+    policies = {"white": white_policy, "black": black_policy}
+    moves = []
+    while game.get_game_state() == "UNFINISHED" and len(moves) < max_moves:
+        color = game._turn
+        view = game.get_board(color)
+        start = time.perf_counter()
+        move = policies[color](view, color, rng)
+        if latencies is not None:
+            latencies[color].append(time.perf_counter() - start)
+        if move is None:
+            break
+        if not game.make_move(*move):
+            raise ValueError("policy for " + color + " made an illegal move: " + repr(move))
+        moves.append(move)
+    return game.get_game_state(), moves
+
+
+def play_batch(task):
+    """
+    Plays one batch of games in a worker process. The batch's seed decides every game in it, so the results
+    don't depend on which process plays it or when.
+    """
+    batch_index, first_game, num_games, white_name, black_name, seed, max_moves = task
+    rng = random.Random("%d-%d" % (seed, batch_index))
+    white_policy = load_policy(white_name)
+    black_policy = load_policy(black_name)
+    records = []
+    for game_index in range(first_game, first_game + num_games):
+        result, moves = play_game(white_policy, black_policy, rng, max_moves)
+        records.append({"game": game_index,
+                        "white": white_name,
+                        "black": black_name,
+                        "result": result,
+                        "moves": moves})
+    return records
+
+
+def run_selfplay(num_games, white="random", black="random", processes=None, batch_size=100, seed=0,
+                 max_moves=500):
+    """
+    Plays num_games games across a pool of processes and yields the finished game records in batches, in the
+    order the batches finish
+    """
+    tasks = []
+    for batch_index, first_game in enumerate(range(0, num_games, batch_size)):
+        count = min(batch_size, num_games - first_game)
+        tasks.append((batch_index, first_game, count, white, black, seed, max_moves))
+
+    with multiprocessing.Pool(processes) as pool:
+        for records in pool.imap_unordered(play_batch, tasks):
+            yield records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays Fog of War chess games between policies on all cores")
+    parser.add_argument("--games", type=int, default=1000, help="number of games to play")
+    parser.add_argument("--white", default="random", help="policy for white: a name or module:function")
+    parser.add_argument("--black", default="random", help="policy for black: a name or module:function")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=100, help="games per batch sent back to the parent")
+    parser.add_argument("--seed", type=int, default=0, help="base seed for every batch")
+    parser.add_argument("--max-moves", type=int, default=500, help="moves after which a game is abandoned")
+    parser.add_argument("--output", help="file to write one JSON game record per line to")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else None
+    start = time.perf_counter()
+    games = 0
+    moves = 0
+    try:
+        for records in run_selfplay(args.games, args.white, args.black, args.processes, args.batch_size,
+                                    args.seed, args.max_moves):
+            games += len(records)
+            moves += sum(len(record["moves"]) for record in records)
+            if output:
+                for record in records:
+                    output.write(json.dumps(record) + "\n")
+            elapsed = time.perf_counter() - start
+            print("%d games, %.1f games/s, %.0f moves/s" % (games, games / elapsed, moves / elapsed),
+                  file=sys.stderr)
+    finally:
+        if output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+# An asyncio server hosting many Fog of War chess games at once, plus a load generator to measure it.
+#
+# Clients talk to the server over TCP with one JSON object per line. Requests:
+#   {"op": "join", "game": "<id>", "role": "white" | "black" | "audience"}
+#   {"op": "move", "from": "e2", "to": "e4"}
+# Replies are {"type": "joined", ...}, {"type": "moved", "ok": true | false} and {"type": "error", "message": ...}.
+# When joining, a client gets {"type": "board", "board": [...], ...} with get_board from its own perspective
+# ("audience" for spectators). After every move it gets {"type": "changes", "changes": [[row, col, piece], ...]}
+# with only the squares that look different to it now.
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from ChessVar import BitboardChessVar, ViewCache
+from selfplay import random_policy
+
+ROLES = ("white", "black", "audience")
+
+
+class Connection:
+    """
+    One client connection. Outgoing lines go through a bounded queue drained by a writer task, so a slow
+    client never blocks the game it's in; a client that falls too far behind is disconnected.
+    """
+    def __init__(self, writer, max_queue):
+        self._writer = writer
+        self._outgoing = asyncio.Queue(max_queue)
+        self._closed = False
+        self.game = None
+        self.role = None
+
+    def send(self, message):
+        """
+        Queues a message (a dictionary) to be sent to the client
+        """
+        self.send_line(json.dumps(message) + "\n")
+
+    def send_line(self, line):
+        """
+        Queues an already encoded line to be sent to the client, disconnecting it if its queue is full
+        """
+        if self._closed:
+            return
+        try:
+            self._outgoing.put_nowait(line)
+        except asyncio.QueueFull:
+            self.close()
+
+    async def write_loop(self):
+        """
+        Writes queued lines to the socket, waiting for the socket to drain after each one
+        """
+        try:
+            while True:
+                line = await self._outgoing.get()
+                if line is None:
+                    break
+                self._writer.write(line.encode())
+                await self._writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._closed = True
+            self._writer.close()
+
+    def close(self):
+        """
+        Stops sending to the client and closes the connection once the writer task notices
+        """
+        if self._closed:
+            return
+        self._closed = True
+        # makes room for the stop signal so the writer task always sees it
+        while not self._outgoing.empty():
+            self._outgoing.get_nowait()
+        self._outgoing.put_nowait(None)
+        # closing the socket also ends the read loop in GameServer.handle_client
+        self._writer.close()
+
+
+class Game:
+    """
+    One game and the connections watching it. Moves are applied one at a time under the game's lock.
+    """
+    def __init__(self, game_id, view_cache=None):
+        self.game_id = game_id
+        self.chess = BitboardChessVar()
+        self.chess.set_view_cache(view_cache)
+        self.players = {}
+        self.audience = set()
+        # the version of the last board message sent for each perspective, which changes are sent against
+        self._sent_versions = {}
+        self._lock = asyncio.Lock()
+
+    def board_line(self, perspective):
+        """
+        Returns the encoded message with the whole board from the given perspective
+        """
+        version, board = self.chess.get_board_snapshot(perspective)
+        self._sent_versions[perspective] = version
+        return self.encode("board", perspective, version, board=board)
+
+    def changes_line(self, perspective):
+        """
+        Returns the encoded message with only the squares that changed from the given perspective since the
+        last message sent for it
+        """
+        version, changes = self.chess.get_board_changes(perspective, self._sent_versions.get(perspective))
+        self._sent_versions[perspective] = version
+        return self.encode("changes", perspective, version, changes=changes)
+
+    def encode(self, message_type, perspective, version, **fields):
+        """
+        Returns a board message as a line of JSON
+        """
+        message = {"type": message_type,
+                   "game": self.game_id,
+                   "perspective": perspective,
+                   "version": version,
+                   "turn": self.chess._turn,
+                   "num_turns": self.chess._num_turns,
+                   "state": self.chess.get_game_state()}
+        message.update(fields)
+        return json.dumps(message) + "\n"
+
+    def add(self, connection, role):
+        """
+        Adds the connection to the game in the given role and sends it the current board.
+        Returns an error message if the role is taken, otherwise None.
+        """
+        if role == "audience":
+            self.audience.add(connection)
+        elif role in self.players:
+            return role + " is already taken in game " + self.game_id
+        else:
+            self.players[role] = connection
+        connection.game = self
+        connection.role = role
+        connection.send({"type": "joined", "game": self.game_id, "role": role})
+        connection.send_line(self.board_line(role))
+        return None
+
+    def remove(self, connection):
+        """
+        Removes the connection from the game
+        """
+        if connection.role == "audience":
+            self.audience.discard(connection)
+        elif self.players.get(connection.role) is connection:
+            del self.players[connection.role]
+
+    def is_empty(self):
+        return not self.players and not self.audience
+
+    async def play(self, connection, square_from, square_to):
+        """
+        Makes the move for the connection's player if it's their turn, then sends every player their new view
+        and the audience the board. Returns True if the move was made.
+        """
+        async with self._lock:
+            if connection.role != self.chess._turn:
+                return False
+            if not self.chess.make_move(square_from, square_to):
+                return False
+            for role, player in self.players.items():
+                player.send_line(self.changes_line(role))
+            if self.audience:
+                # the audience all get the same line, so it's only encoded once
+                line = self.changes_line("audience")
+                for spectator in self.audience:
+                    spectator.send_line(line)
+            return True
+
+
+class GameServer:
+    """
+    Hosts games in memory, creating each one when its first client joins and dropping it when the last one leaves.
+    If view_cache_bytes is given, every game shares a ViewCache of that size, so players of games in the same
+    position (such as every new game) and reconnecting players get their views from it.
+    """
+    def __init__(self, max_games=10000, max_queue=64, view_cache_bytes=0):
+        self._games = {}
+        self._max_games = max_games
+        self._max_queue = max_queue
+        self.view_cache = ViewCache(view_cache_bytes) if view_cache_bytes else None
+
+    async def handle_client(self, reader, writer):
+        """
+        Reads requests from one client until it disconnects. The next request isn't read until the current
+        one has been handled, so a client can't flood the server.
+        """
+        connection = Connection(writer, self._max_queue)
+        write_task = asyncio.create_task(connection.write_loop())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    await self.handle_request(connection, request)
+                except (ValueError, KeyError, TypeError, IndexError) as error:
+                    connection.send({"type": "error", "message": "bad request: " + str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            if connection.game is not None:
+                connection.game.remove(connection)
+                if connection.game.is_empty():
+                    self._games.pop(connection.game.game_id, None)
+            connection.close()
+            await write_task
+
+    async def handle_request(self, connection, request):
+        """
+        Carries out one request from a client
+        """
+        op = request["op"]
+        if op == "join":
+            role = request["role"]
+            game_id = str(request["game"])
+            if connection.game is not None:
+                connection.send({"type": "error", "message": "already in game " + connection.game.game_id})
+            elif role not in ROLES:
+                connection.send({"type": "error", "message": "unknown role " + repr(role)})
+            elif game_id not in self._games and len(self._games) >= self._max_games:
+                connection.send({"type": "error", "message": "server is full"})
+            else:
+                game = self._games.get(game_id)
+                if game is None:
+                    game = self._games[game_id] = Game(game_id, self.view_cache)
+                message = game.add(connection, role)
+                if message is not None:
+                    connection.send({"type": "error", "message": message})
+        elif op == "move":
+            if connection.game is None:
+                connection.send({"type": "error", "message": "not in a game"})
+            else:
+                made = await connection.game.play(connection, request["from"], request["to"])
+                connection.send({"type": "moved", "ok": made})
+        else:
+            connection.send({"type": "error", "message": "unknown op " + repr(op)})
+
+    async def serve(self, host, port):
+        """
+        Accepts clients on the given address until cancelled
+        """
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def play_load_game(host, port, game_id, rng, stats, max_moves):
+    """
+    Connects both players of one game and plays random moves until it's over or max_moves have been made,
+    recording how long the server takes to acknowledge each move
+    """
+    async def player(color):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write((json.dumps({"op": "join", "game": game_id, "role": color}) + "\n").encode())
+        sent_at = None
+        board = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                message = json.loads(line)
+                if message["type"] == "moved":
+                    stats["latencies"].append(time.perf_counter() - sent_at)
+                    if message["ok"]:
+                        stats["moves"] += 1
+                    else:
+                        stats["rejected"] += 1
+                elif message["type"] == "error":
+                    stats["errors"] += 1
+                    return
+                elif message["type"] in ("board", "changes"):
+                    if message["type"] == "board":
+                        board = message["board"]
+                    else:
+                        for row, col, piece in message["changes"]:
+                            board[row][col] = piece
+                    if message["state"] != "UNFINISHED" or message["num_turns"] >= max_moves:
+                        return
+                    if message["turn"] == color:
+                        move = random_policy(board, color, rng)
+                        if move is None:
+                            return
+                        sent_at = time.perf_counter()
+                        writer.write((json.dumps({"op": "move", "from": move[0], "to": move[1]}) + "\n").encode())
+                        await writer.drain()
+        finally:
+            writer.close()
+
+    # when one player stops, for example because it has no moves left, the other one stops too
+    players = [asyncio.create_task(player("white")), asyncio.create_task(player("black"))]
+    done, pending = await asyncio.wait(players, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*players, return_exceptions=True)
+    stats["games"] += 1
+
+
+async def run_load(host, port, games, max_moves, seed):
+    """
+    Plays the given number of games against the server at the same time and returns the statistics
+    """
+    rng = random.Random(seed)
+    stats = {"games": 0, "moves": 0, "rejected": 0, "errors": 0, "latencies": []}
+    start = time.perf_counter()
+    await asyncio.gather(*(play_load_game(host, port, "load-%d" % index, rng, stats, max_moves)
+                           for index in range(games)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(stats.pop("latencies"))
+    stats["seconds"] = elapsed
+    stats["moves_per_second"] = stats["moves"] / elapsed
+    if latencies:
+        for percentile in (50, 90, 99):
+            index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+            stats["latency_p%d_ms" % percentile] = latencies[index] * 1000
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts Fog of War chess games over TCP, or generates load")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_command = commands.add_parser("serve", help="runs the game server")
+    serve_command.add_argument("--host", default="127.0.0.1")
+    serve_command.add_argument("--port", type=int, default=8765)
+    serve_command.add_argument("--max-games", type=int, default=10000, help="most games hosted at once")
+    serve_command.add_argument("--max-queue", type=int, default=64,
+                               help="unsent messages after which a slow client is disconnected")
+    serve_command.add_argument("--view-cache-mb", type=int, default=0,
+                               help="megabytes of players' views to cache across games (default: no cache)")
+    load_command = commands.add_parser("load", help="plays many games against a running server at once")
+    load_command.add_argument("--host", default="127.0.0.1")
+    load_command.add_argument("--port", type=int, default=8765)
+    load_command.add_argument("--games", type=int, default=100, help="games to play at the same time")
+    load_command.add_argument("--max-moves", type=int, default=200, help="moves after which a game is abandoned")
+    load_command.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            server = GameServer(args.max_games, args.max_queue, args.view_cache_mb << 20)
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(asyncio.run(run_load(args.host, args.port, args.games, args.max_moves, args.seed)),
+                         indent=2))
+
+
+if __name__ == "__main__":
+    main()
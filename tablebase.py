@@ -0,0 +1,322 @@
+# Builds endgame tables for Fog of War chess by retrograde analysis, for ChessVar.Tablebases to look positions up in.
+#
+# The game is won by capturing the enemy king. There is no check, so a king can move next to the enemy king or
+# stay where it can be captured, and there is no castling, en passant or promotion. A table holds, for every
+# placement of its pieces and side to move, the number of plies within which the side to move can force a king
+# capture (positive), or within which it loses its king (negative), or 0 if neither side can force one. A
+# player with no moves can't lose a king, so such positions are worth 0.
+#
+# Building a table first lists the moves of every position, on a pool of processes. Moves that keep all the
+# pieces lead to other positions of the same table, and moves that capture a piece other than a king lead to a
+# position of a smaller table, which is built first. Values are then worked out backwards from the king
+# captures, one ply at a time: a position is won in d plies if a move leads to a position lost in d - 1, and
+# lost in d plies once every move leads to a position won for the opponent in at most d - 1.
+#
+# Moves within the table are written to a temporary file as pairs of 32-bit table indices as they're listed, and
+# each ply reads them back a slice at a time, so they never all have to fit in memory at once. A table with n
+# pieces has 2 * 64 ** n positions and around 10 such moves per position: building KRkp peaks at about 650 MB of
+# memory, mostly per-position arrays, and 2.7 GB of disk for its moves. Five pieces would need 64 times that,
+# so tables are limited to four.
+
+import argparse
+import array
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from ChessVar import (piece_moves, SQUARE_MASKS, SIGNATURE_ORDER, TABLE_HEADER, TABLE_INVALID, TABLE_MAGIC,
+                      TABLE_SUFFIX, TABLE_VERSION)
+
+# positions per task sent to a worker
+CHUNK_SIZE = 1 << 16
+# moves read back at a time while solving
+MOVES_PER_SLICE = 1 << 22
+MAX_PIECES = 4
+
+
+def normalize_signature(text):
+    """
+    Returns the material signature of the given pieces in SIGNATURE_ORDER, such as "KRk" for "kKR". Raises
+    ValueError unless there is exactly one king of each color.
+    """
+    if any(piece not in SIGNATURE_ORDER for piece in text) or text.count("K") != 1 or text.count("k") != 1:
+        raise ValueError("a signature needs one K, one k and other pieces from " + SIGNATURE_ORDER + ": " + repr(text))
+    if len(text) > MAX_PIECES:
+        raise ValueError("a signature can have at most %d pieces: %r" % (MAX_PIECES, text))
+    return "".join(sorted(text, key=SIGNATURE_ORDER.index))
+
+
+def sub_signatures(signature):
+    """
+    Returns the signatures left after capturing each piece other than a king
+    """
+    return sorted(set(signature[:index] + signature[index + 1:]
+                      for index, piece in enumerate(signature) if piece not in "Kk"))
+
+
+def table_path(directory, signature):
+    """
+    Returns the path of the table file for the given signature
+    """
+    return os.path.join(directory, signature + TABLE_SUFFIX)
+
+
+def open_table(directory, signature):
+    """
+    Returns the values of a finished table as a read-only array mapped from its file
+    """
+    return np.memmap(table_path(directory, signature), dtype="<i2", mode="r", offset=TABLE_HEADER.size)
+
+
+def squares_of(index, num_pieces):
+    """
+    Takes in a table index and returns the list of squares of the pieces and whether black is to move
+    """
+    black_to_move = index & 1
+    index >>= 1
+    squares = [0] * num_pieces
+    for position in range(num_pieces - 1, -1, -1):
+        index, squares[position] = divmod(index, 64)
+    return squares, black_to_move
+
+
+def index_of(squares, black_to_move):
+    """
+    Returns the table index of the given squares of the pieces and side to move
+    """
+    index = 0
+    for square in squares:
+        index = index * 64 + square
+    return index * 2 + black_to_move
+
+
+def is_valid(signature, squares):
+    """
+    Returns True if the pieces can stand on the given squares: one piece per square, and no pawn on its own
+    side's back rank, which pawns can never go back to
+    """
+    if len(set(squares)) != len(squares):
+        return False
+    for piece, square in zip(signature, squares):
+        if (piece == "P" and square >= 56) or (piece == "p" and square < 8):
+            return False
+    return True
+
+
+def to_mover(value):
+    """
+    Takes in the value of a position for the player to move there and returns it for the player who moved into
+    it, one ply further away
+    """
+    if value < 0:
+        return -value + 1
+    if value > 0:
+        return -value - 1
+    return 0
+
+
+def list_moves_range(task):
+    """
+    Lists the moves of every position from start up to stop of a table in a worker process. Returns start, an
+    (n, 2) array of the (origin, destination) table indices of moves within the table, and for every position
+    whether it's valid, whether it has moves, the number of moves within the table, and the best win, worst loss
+    and any draw among moves that capture a piece.
+    """
+    signature, directory, start, stop = task
+    num_pieces = len(signature)
+    sub_tables = {sub: open_table(directory, sub) for sub in sub_signatures(signature)}
+    white = [piece.isupper() for piece in signature]
+
+    # 32-bit arrays rather than lists, which would take several times the memory
+    sources = array.array("i")
+    targets = array.array("i")
+    count = stop - start
+    valid = np.zeros(count, dtype=bool)
+    has_moves = np.zeros(count, dtype=bool)
+    # a side with at most three pieces has fewer than 256 moves
+    degree = np.zeros(count, dtype=np.uint8)
+    capture_win = np.zeros(count, dtype=np.int16)
+    capture_loss = np.zeros(count, dtype=np.int16)
+    capture_draw = np.zeros(count, dtype=bool)
+
+    for offset in range(count):
+        index = start + offset
+        squares, black_to_move = squares_of(index, num_pieces)
+        if not is_valid(signature, squares):
+            continue
+        valid[offset] = True
+        on_square = {square: position for position, square in enumerate(squares)}
+        own = enemy = 0
+        for position, square in enumerate(squares):
+            if white[position] != bool(black_to_move):
+                own |= SQUARE_MASKS[square]
+            else:
+                enemy |= SQUARE_MASKS[square]
+
+        best_win = 0
+        worst_loss = 0
+        for position, square in enumerate(squares):
+            if white[position] == bool(black_to_move):
+                continue
+            destinations = piece_moves(signature[position], square, own, enemy)[0]
+            while destinations:
+                low_bit = destinations & -destinations
+                destination = low_bit.bit_length() - 1
+                destinations ^= low_bit
+                has_moves[offset] = True
+                captured = on_square.get(destination)
+                moved = squares[:]
+                moved[position] = destination
+                if captured is None:
+                    sources.append(index)
+                    targets.append(index_of(moved, 1 - black_to_move))
+                    degree[offset] += 1
+                    continue
+                if signature[captured] in "Kk":
+                    value = 1
+                else:
+                    sub = signature[:captured] + signature[captured + 1:]
+                    del moved[captured]
+                    value = to_mover(int(sub_tables[sub][index_of(moved, 1 - black_to_move)]))
+                if value > 0:
+                    best_win = value if not best_win else min(best_win, value)
+                elif value < 0:
+                    worst_loss = max(worst_loss, -value)
+                else:
+                    capture_draw[offset] = True
+        capture_win[offset] = best_win
+        capture_loss[offset] = worst_loss
+
+    moves = np.column_stack((np.frombuffer(sources, dtype=np.int32), np.frombuffer(targets, dtype=np.int32)))
+    return start, moves, valid, has_moves, degree, capture_win, capture_loss, capture_draw
+
+
+def read_moves(path):
+    """
+    Yields the origin and destination index arrays of the moves in a file written by list_and_solve, at most
+    MOVES_PER_SLICE at a time
+    """
+    with open(path, "rb") as moves_file:
+        while True:
+            moves = np.fromfile(moves_file, dtype=np.int32, count=2 * MOVES_PER_SLICE).reshape(-1, 2)
+            if not len(moves):
+                return
+            yield moves[:, 0], moves[:, 1]
+
+
+def solve(size, moves_path, valid, has_moves, degree, capture_win, capture_loss, capture_draw):
+    """
+    Works out the value of every position, one ply at a time, from the file of moves within the table, and
+    returns the array of values
+    """
+    values = np.zeros(size, dtype=np.int16)
+    values[~valid] = TABLE_INVALID
+    # positions without moves are draws, and invalid positions are never reached
+    resolved = ~valid | ~has_moves
+    # a capture that doesn't lose stops a position from being lost
+    can_avoid_loss = capture_draw | (capture_win > 0)
+    # the number of moves within the table leading to positions won for the opponent
+    opponent_wins = np.zeros(size, dtype=np.uint8)
+    last_capture = int(max(capture_win.max(initial=0), capture_loss.max(initial=0)))
+    won_before = np.zeros(size, dtype=bool)
+    lost_before = np.zeros(size, dtype=bool)
+
+    plies = 0
+    while True:
+        plies += 1
+        won = capture_win == plies
+        # one pass over the moves finds the positions with a move to one lost last ply, and counts the moves to
+        # positions won last ply, which is all the losses of this ply need
+        if won_before.any() or lost_before.any():
+            for sources, targets in read_moves(moves_path):
+                won[sources[lost_before[targets]]] = True
+                np.add.at(opponent_wins, sources[won_before[targets]], 1)
+        won &= ~resolved
+        lost = ~resolved & ~won & ~can_avoid_loss & (opponent_wins == degree) & (capture_loss <= plies)
+        values[won] = plies
+        values[lost] = -plies
+        resolved |= won | lost
+        won_before = won
+        lost_before = lost
+        if not won.any() and not lost.any() and plies > last_capture:
+            # anything still unresolved can't be forced either way
+            return values
+
+
+def list_and_solve(size, pool, tasks, moves_path):
+    """
+    Lists the moves of every position with the given tasks on the pool, writing the moves within the table to
+    a temporary file at moves_path as pairs of 32-bit indices, and returns the array of values solved from them
+    """
+    valid = np.zeros(size, dtype=bool)
+    has_moves = np.zeros(size, dtype=bool)
+    degree = np.zeros(size, dtype=np.uint8)
+    capture_win = np.zeros(size, dtype=np.int16)
+    capture_loss = np.zeros(size, dtype=np.int16)
+    capture_draw = np.zeros(size, dtype=bool)
+    columns = (valid, has_moves, degree, capture_win, capture_loss, capture_draw)
+    try:
+        with open(moves_path, "wb") as moves_file:
+            for start, chunk_moves, *chunk_columns in pool.imap_unordered(list_moves_range, tasks):
+                moves_file.write(chunk_moves.tobytes())
+                for column, chunk_column in zip(columns, chunk_columns):
+                    column[start:start + len(chunk_column)] = chunk_column
+        values = solve(size, moves_path, *columns)
+    finally:
+        os.remove(moves_path)
+    return values
+
+
+def build_table(signature, directory, processes=None, pool=None):
+    """
+    Builds the table for the given signature in the given directory, building the tables it depends on first
+    unless they're already there. Returns the number of positions in the table.
+    """
+    signature = normalize_signature(signature)
+    for sub in sub_signatures(signature):
+        if not os.path.exists(table_path(directory, sub)):
+            build_table(sub, directory, processes, pool)
+
+    size = 2 * 64 ** len(signature)
+    tasks = [(signature, directory, start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE)]
+    path = table_path(directory, signature)
+    if pool is None:
+        with multiprocessing.Pool(processes) as own_pool:
+            values = list_and_solve(size, own_pool, tasks, path + ".moves.tmp")
+    else:
+        values = list_and_solve(size, pool, tasks, path + ".moves.tmp")
+
+    # written to a temporary file first, so a table file is always complete
+    with open(path + ".tmp", "wb") as table_file:
+        table_file.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, signature.encode()))
+        table_file.write(values.astype("<i2").tobytes())
+    os.replace(path + ".tmp", path)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds Fog of War chess endgame tables by retrograde analysis")
+    parser.add_argument("signatures", nargs="+",
+                        help="pieces of each table to build, such as KQk or KRkp (at most %d)" % MAX_PIECES)
+    parser.add_argument("--directory", default="tables", help="directory to write the tables to")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="rebuild tables that already exist")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    with multiprocessing.Pool(args.processes) as pool:
+        for signature in args.signatures:
+            signature = normalize_signature(signature)
+            if os.path.exists(table_path(args.directory, signature)) and not args.force:
+                print("%s already built" % signature, file=sys.stderr)
+                continue
+            start = time.perf_counter()
+            size = build_table(signature, args.directory, pool=pool)
+            print("%s: %d positions in %.1f s" % (signature, size, time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
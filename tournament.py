@@ -0,0 +1,270 @@
+# Plays tournaments between Fog of War chess policies on a pool of processes, and reports Elo ratings with
+# confidence intervals and how long each policy takes to pick a move.
+#
+# Policies are the same as in selfplay.py: a built-in name or "module:function", seeing only get_board from
+# their own perspective. Every pairing plays the same number of games with each policy as white. Each game's
+# seed comes from the tournament seed, the pairing and the game number, so a game plays out the same whichever
+# process plays it and whenever. Finished games are appended to a results file, one JSON object per line, and
+# games already in the file are skipped, so an interrupted tournament carries on where it stopped. A game's id
+# holds the tournament seed and move limit along with the pairing and game number, so games played with other
+# settings are never mistaken for it.
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+from selfplay import load_policy, play_game
+
+# converts a difference in natural-log strength into Elo points
+ELO_SCALE = 400 / math.log(10)
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def make_pairings(players, pairing_format="round-robin"):
+    """
+    Returns the list of (first, second) pairings: every two players for "round-robin", or the first player
+    against each of the others for "gauntlet"
+    """
+    if pairing_format == "gauntlet":
+        return [(players[0], other) for other in players[1:]]
+    return list(itertools.combinations(players, 2))
+
+
+def make_tasks(pairings, games_per_pairing, seed, max_moves):
+    """
+    Returns a task for every game of the tournament, with the players swapping colors from one game to the next
+    """
+    tasks = []
+    for first, second in pairings:
+        for number in range(games_per_pairing):
+            white, black = (first, second) if number % 2 == 0 else (second, first)
+            game = "%s|%s|%d" % (first, second, number)
+            game_id = "%d|%d|%s" % (seed, max_moves, game)
+            tasks.append((game_id, white, black, "%d|%s" % (seed, game), max_moves))
+    return tasks
+
+
+def play_tournament_game(task):
+    """
+    Plays one tournament game in a worker process and returns its record: the players, the winning color (None
+    for a game that didn't finish), the number of moves and each player's time per move in milliseconds
+    """
+    game_id, white, black, seed, max_moves = task
+    latencies = {"white": [], "black": []}
+    result, moves = play_game(load_policy(white), load_policy(black), random.Random(seed), max_moves, latencies)
+    winner = None
+    if result != "UNFINISHED":
+        # the game ends on the move that captures a king, so whoever made the last move won
+        winner = "white" if len(moves) % 2 == 1 else "black"
+    return {"id": game_id,
+            "white": white,
+            "black": black,
+            "winner": winner,
+            "moves": len(moves),
+            "latencies_ms": {color: [round(seconds * 1000, 3) for seconds in latencies[color]]
+                             for color in latencies}}
+
+
+def read_results(path):
+    """
+    Returns a dictionary of the game records in a results file by game id, or an empty one if there's no file.
+    A last line cut short by an interruption is ignored.
+    """
+    records = {}
+    try:
+        with open(path) as results:
+            for line in results:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["id"]] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def run_tournament(players, games_per_pairing, results_path, pairing_format="round-robin", processes=None,
+                   seed=0, max_moves=300):
+    """
+    Plays every game of the tournament that isn't already in the results file, appending each one to the file
+    as it finishes, and yields the number of games finished so far and the total
+    """
+    tasks = make_tasks(make_pairings(players, pairing_format), games_per_pairing, seed, max_moves)
+    done = read_results(results_path)
+    remaining = [task for task in tasks if task[0] not in done]
+    finished = len(tasks) - len(remaining)
+    if not remaining:
+        return
+    with open(results_path, "a") as results, multiprocessing.Pool(processes) as pool:
+        for record in pool.imap_unordered(play_tournament_game, remaining):
+            results.write(json.dumps(record) + "\n")
+            # flushed after every game, so an interruption loses at most the games still being played
+            results.flush()
+            finished += 1
+            yield finished, len(tasks)
+
+
+def compute_ratings(records, players):
+    """
+    Returns a dictionary of each player's Elo rating (averaging 0) and the half-width of its 95% confidence
+    interval, fitted to the game results with the Bradley-Terry model. Unfinished games count as draws, and
+    every pairing gets one extra draw so a player who won or lost every game still gets a finite rating.
+    """
+    games = {}
+    scores = {player: 0.0 for player in players}
+    for record in records:
+        pair = tuple(sorted((record["white"], record["black"])))
+        games[pair] = games.get(pair, 0) + 1
+        if record["winner"] is None:
+            scores[record["white"]] += 0.5
+            scores[record["black"]] += 0.5
+        else:
+            scores[record[record["winner"]]] += 1
+    for pair in games:
+        games[pair] += 1
+        for player in pair:
+            scores[player] += 0.5
+
+    # minorization-maximization: each player's strength becomes its score over its expected games against
+    # the current strengths, until the strengths stop changing
+    strengths = {player: 1.0 for player in players}
+    for _ in range(10000):
+        updated = {}
+        for player in players:
+            expected = sum(count / (strengths[player] + strengths[other])
+                           for pair, count in games.items() if player in pair
+                           for other in pair if other != player)
+            updated[player] = scores[player] / expected if expected else strengths[player]
+        mean_log = sum(math.log(strength) for strength in updated.values()) / len(updated)
+        updated = {player: strength / math.exp(mean_log) for player, strength in updated.items()}
+        converged = all(abs(math.log(updated[player] / strengths[player])) < 1e-9 for player in players)
+        strengths = updated
+        if converged:
+            break
+
+    ratings = {}
+    for player in players:
+        # the standard error comes from the curvature of the likelihood around the fitted strengths
+        information = 0.0
+        for pair, count in games.items():
+            if player in pair:
+                other = pair[0] if pair[1] == player else pair[1]
+                win_chance = strengths[player] / (strengths[player] + strengths[other])
+                information += count * win_chance * (1 - win_chance)
+        interval = 1.96 * ELO_SCALE / math.sqrt(information) if information else None
+        ratings[player] = {"elo": ELO_SCALE * math.log(strengths[player]), "interval": interval}
+    return ratings
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile of a sorted list of values
+    """
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+def make_report(records, players, max_latency_ms):
+    """
+    Returns a dictionary with each player's rating, results and time per move, flagging players whose 99th
+    percentile time per move is over max_latency_ms, and the score of each pairing
+    """
+    ratings = compute_ratings(records, players)
+    report = {"games": len(records), "players": {}, "pairings": {}}
+    for player in players:
+        latencies = []
+        wins = losses = draws = 0
+        for record in records:
+            for color in ("white", "black"):
+                if record[color] != player:
+                    continue
+                latencies.extend(record["latencies_ms"][color])
+                if record["winner"] is None:
+                    draws += 1
+                elif record["winner"] == color:
+                    wins += 1
+                else:
+                    losses += 1
+        latencies.sort()
+        entry = dict(ratings[player], wins=wins, losses=losses, draws=draws, moves=len(latencies))
+        if latencies:
+            for percent in LATENCY_PERCENTILES:
+                entry["latency_p%d_ms" % percent] = percentile(latencies, percent)
+            entry["latency_max_ms"] = latencies[-1]
+            entry["slow"] = entry["latency_p99_ms"] > max_latency_ms
+        report["players"][player] = entry
+
+    for record in records:
+        key = " vs ".join(sorted((record["white"], record["black"])))
+        first = sorted((record["white"], record["black"]))[0]
+        pairing = report["pairings"].setdefault(key, {"games": 0, "score": 0.0})
+        pairing["games"] += 1
+        if record["winner"] is None:
+            pairing["score"] += 0.5
+        elif record[record["winner"]] == first:
+            pairing["score"] += 1
+    return report
+
+
+def print_report(report, file=sys.stdout):
+    """
+    Prints the players from the highest rating to the lowest, with their results and times per move
+    """
+    print("%-30s %7s %7s %6s %6s %6s %9s %9s %9s" % ("player", "elo", "+/-", "wins", "losses", "draws",
+                                                     "p50 ms", "p99 ms", "max ms"), file=file)
+    for player, entry in sorted(report["players"].items(), key=lambda item: -item[1]["elo"]):
+        interval = "%7.1f" % entry["interval"] if entry["interval"] is not None else "%7s" % "-"
+        latencies = ("%9.2f %9.2f %9.2f" % (entry["latency_p50_ms"], entry["latency_p99_ms"], entry["latency_max_ms"])
+                     if entry["moves"] else "%9s %9s %9s" % ("-", "-", "-"))
+        print("%-30s %7.1f %s %6d %6d %6d %s%s" % (player, entry["elo"], interval, entry["wins"], entry["losses"],
+                                                  entry["draws"], latencies, "  SLOW" if entry.get("slow") else ""),
+              file=file)
+    for key, pairing in sorted(report["pairings"].items()):
+        print("%s: %.1f / %d" % (key, pairing["score"], pairing["games"]), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays a tournament between Fog of War chess policies")
+    parser.add_argument("players", nargs="+", help="policies: names from selfplay.py or module:function")
+    parser.add_argument("--format", choices=("round-robin", "gauntlet"), default="round-robin",
+                        help="every pair of players, or the first player against each of the others")
+    parser.add_argument("--games", type=int, default=100, help="games per pairing, half with each player as white")
+    parser.add_argument("--results", default="tournament.jsonl",
+                        help="file the game records are appended to; games already in it aren't replayed")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="tournament seed every game's seed comes from")
+    parser.add_argument("--max-moves", type=int, default=300, help="moves after which a game counts as a draw")
+    parser.add_argument("--max-latency-ms", type=float, default=100.0,
+                        help="99th percentile time per move over which a player is flagged as slow")
+    parser.add_argument("--report", help="file to write the report to as JSON")
+    args = parser.parse_args()
+    if len(set(args.players)) != len(args.players) or len(args.players) < 2:
+        parser.error("a tournament needs at least two different players")
+
+    start = time.perf_counter()
+    played = 0
+    for finished, total in run_tournament(args.players, args.games, args.results, args.format, args.processes,
+                                          args.seed, args.max_moves):
+        played += 1
+        print("\r%d / %d games, %.1f games/s" % (finished, total, played / (time.perf_counter() - start)),
+              end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+    # only the games of this tournament count, in case the results file holds others
+    game_ids = set(task[0] for task in make_tasks(make_pairings(args.players, args.format), args.games,
+                                                  args.seed, args.max_moves))
+    records = [record for game_id, record in read_results(args.results).items() if game_id in game_ids]
+    report = make_report(records, args.players, args.max_latency_ms)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Checks that recorded Fog of War chess games only contain legal moves, on a pool of processes.
+#
+# Games are replayed on BitboardChessVar, whose legality check is a lookup in the cached moves of the piece being
+# moved. No player's view of the board is built along the way, so a game costs little more than its moves.
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from ChessVar import BitboardChessVar
+from archive import ArchiveReader
+
+# a new game of each engine class, which every new game of that class is copied from
+NEW_GAMES = {}
+
+
+def new_game(engine=BitboardChessVar):
+    """
+    Returns a new game of the given engine class. Copying the same new game every time is cheaper than setting
+    up each one from scratch.
+    """
+    game = NEW_GAMES.get(engine)
+    if game is None:
+        game = NEW_GAMES[engine] = engine()
+    return game.clone()
+
+
+def find_illegal_moves(games, engine=BitboardChessVar):
+    """
+    Takes in an iterable of games, each a list of (square_from, square_to) moves in algebraic notation, and
+    yields (game index, move index) for the first illegal move of every game that has one
+    """
+    for game_index, moves in enumerate(games):
+        moves = list(moves)
+        made = new_game(engine).apply_moves(moves)
+        if made != len(moves):
+            yield game_index, made
+
+
+def validate_archive_range(task):
+    """
+    Replays the games of an archive from index start up to stop in a worker process and returns how many were
+    checked and the (game index, move index) of the first illegal move of every game that has one
+    """
+    path, start, stop = task
+    illegal = []
+    with ArchiveReader(path) as reader:
+        for index in range(start, stop):
+            num_moves = reader.read_header(index)[1]
+            made = new_game().apply_moves_indices(reader.iter_moves(index))
+            if made != num_moves:
+                illegal.append((index, made))
+    return stop - start, illegal
+
+
+def validate_records_chunk(lines):
+    """
+    Replays a chunk of JSON game records (as written by selfplay.py) in a worker process and returns how many
+    were checked and the (game number, move index) of the first illegal move of every game that has one
+    """
+    records = [json.loads(line) for line in lines]
+    illegal = [(records[game_index]["game"], move_index)
+               for game_index, move_index in find_illegal_moves(record["moves"] for record in records)]
+    return len(records), illegal
+
+
+def read_chunks(path, size):
+    """
+    Yields the lines of a file in lists of at most the given size
+    """
+    with open(path) as records:
+        chunk = []
+        for line in records:
+            chunk.append(line)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def make_tasks(path, chunk_size):
+    """
+    Returns the kind of game log at the given path, "records" for a file of JSON game records ending in .jsonl
+    and "archive" otherwise, and the tasks covering it: lists of at most chunk_size record lines, or
+    (path, start, stop) ranges of archive game indices
+    """
+    if path.endswith(".jsonl"):
+        return "records", read_chunks(path, chunk_size)
+    with ArchiveReader(path) as reader:
+        num_games = len(reader)
+    return "archive", ((path, start, min(start + chunk_size, num_games)) for start in range(0, num_games, chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks recorded Fog of War chess games for illegal moves")
+    parser.add_argument("games", help="a game archive, or a file of JSON game records ending in .jsonl")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="games per task sent to a worker")
+    args = parser.parse_args()
+
+    kind, tasks = make_tasks(args.games, args.chunk_size)
+    worker = validate_records_chunk if kind == "records" else validate_archive_range
+
+    start = time.perf_counter()
+    checked = 0
+    num_illegal = 0
+    with multiprocessing.Pool(args.processes) as pool:
+        for count, illegal in pool.imap(worker, tasks):
+            checked += count
+            num_illegal += len(illegal)
+            for game_index, move_index in illegal:
+                print(json.dumps({"game": game_index, "illegal_move": move_index}))
+    elapsed = time.perf_counter() - start
+    print("%d games checked, %d with illegal moves, %.0f games/s" % (checked, num_illegal, checked / elapsed),
+          file=sys.stderr)
+    sys.exit(1 if num_illegal else 0)
+
+
+if __name__ == "__main__":
+    main()